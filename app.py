@@ -1,7 +1,6 @@
 import gradio as gr
 from model.analyzer import analyze_content
-import asyncio
-import time
+import json
 import httpx
 import subprocess
 import atexit
@@ -253,10 +252,28 @@ custom_css = """
 """
 
 # The rest of the Python code remains exactly the same
+def format_triggers(triggers):
+    if not triggers or triggers == ["None"]:
+        return "✓ No triggers detected in the content."
+    trigger_list = "\n".join([f"• {trigger}" for trigger in triggers])
+    return f"⚠ Triggers Detected:\n{trigger_list}"
+
+def format_partial_results(partial_results):
+    """Categories already decided while the rest of the analysis is still running"""
+    detected = [category for category, found in partial_results.items() if found]
+    cleared = [category for category, found in partial_results.items() if not found]
+    lines = [f"Checked {len(partial_results)} categories so far..."]
+    if detected:
+        lines.append("⚠ Detected: " + ", ".join(detected))
+    if cleared:
+        lines.append("✓ Not detected: " + ", ".join(cleared))
+    return "\n".join(lines)
+
 async def analyze_with_progress(movie_name, progress=gr.Progress()):
-    """Handle analysis with progress updates in Gradio"""
+    """Handle analysis with progress updates in Gradio, pushed by the API as server-sent events"""
     try:
-        async with httpx.AsyncClient(timeout=60.0) as client:
+        # The stream sends a keep-alive every 15s while the model works; three missed ones mean the server is gone
+        async with httpx.AsyncClient(timeout=httpx.Timeout(60.0, read=45.0)) as client:
             # Start the analysis
             response = await client.get(
                 "http://localhost:8000/api/start_analysis",
@@ -265,76 +282,48 @@ async def analyze_with_progress(movie_name, progress=gr.Progress()):
             response.raise_for_status()
             task_id = response.json()["task_id"]
             
-            # Poll for progress
-            while True:
-                progress_response = await client.get(
-                    f"http://localhost:8000/api/progress/{task_id}"
-                )
-                progress_response.raise_for_status()
-                status = progress_response.json()
-                
-                # Update Gradio progress
-                progress(status["progress"], desc=status["status"])
-                
-                if status["is_complete"]:
-                    if status["error"]:
-                        return f"Error: {status['error']}"
-                    elif status["result"]:
-                        triggers = status["result"].get("detected_triggers", [])
-                        if not triggers or triggers == ["None"]:
-                            return "✓ No triggers detected in the content."
-                        else:
-                            trigger_list = "\n".join([f"• {trigger}" for trigger in triggers])
-                            return f"⚠ Triggers Detected:\n{trigger_list}"
-                    break
-                
-                await asyncio.sleep(0.5)
+            # Follow the progress stream
+            shown = {}
+            async with client.stream("GET", f"http://localhost:8000/api/progress/{task_id}/stream") as stream:
+                stream.raise_for_status()
+                async for line in stream.aiter_lines():
+                    if not line.startswith("data: "):
+                        continue
+                    status = json.loads(line[len("data: "):])
+                    
+                    # Update Gradio progress
+                    progress(status["progress"], desc=status["status"])
+                    
+                    if status["is_complete"]:
+                        if status["error"]:
+                            yield f"Error: {status['error']}"
+                        elif status["result"]:
+                            yield format_triggers(status["result"].get("detected_triggers", []))
+                        return
+
+                    if status["partial_results"] != shown:
+                        shown = status["partial_results"]
+                        yield format_partial_results(shown)
+
+            yield "Error: the progress stream ended before the analysis finished"
     
     except Exception as e:
-        return f"Error: {str(e)}"
+        yield f"Error: {str(e)}"
 
-def analyze_with_loading(text, progress=gr.Progress()):
+async def analyze_with_loading(text, progress=gr.Progress()):
     """
-    Synchronous wrapper for the async analyze_content function with smooth progress updates
+    Analyze the text, with progress reported by the analyzer as its batches finish
     """
-    # Initialize progress
     progress(0, desc="Starting analysis...")
-    
-    # Initial setup phase - smoother progression
-    for i in range(25):
-        time.sleep(0.04)  # Slightly longer sleep for smoother animation
-        progress((i + 1) / 100, desc="Initializing analysis...")
-    
-    # Pre-processing phase
-    for i in range(25, 45):
-        time.sleep(0.03)
-        progress((i + 1) / 100, desc="Pre-processing content...")
-    
-    # Perform analysis
-    progress(0.45, desc="Analyzing content...")
     try:
-        result = asyncio.run(analyze_content(text))
-        
-        # Analysis progress simulation
-        for i in range(45, 75):
-            time.sleep(0.03)
-            progress((i + 1) / 100, desc="Processing results...")
-            
+        result = await analyze_content(text, progress)
     except Exception as e:
         return f"Error during analysis: {str(e)}"
-    
-    # Final processing with smooth progression
-    for i in range(75, 100):
-        time.sleep(0.02)
-        progress((i + 1) / 100, desc="Finalizing results...")
+    if "error" in result:
+        return f"Error during analysis: {result['error']}"
     
     # Format the results
-    triggers = result["detected_triggers"]
-    if triggers == ["None"]:
-        return "✓ No triggers detected in the content."
-    else:
-        trigger_list = "\n".join([f"• {trigger}" for trigger in triggers])
-        return f"⚠ Triggers Detected:\n{trigger_list}"
+    return format_triggers(result["detected_triggers"])
 
 # Update the Gradio interface with new styling
 with gr.Blocks(css=custom_css, theme=gr.themes.Base()) as iface:
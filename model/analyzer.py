@@ -1,24 +1,308 @@
 import os
-from transformers import AutoTokenizer, AutoModelForCausalLM
+import re
+import time
+import inspect
 import torch
 from datetime import datetime
 import gradio as gr
-from typing import Dict, List, Union, Optional
+from typing import Callable, Dict, Iterator, List, Union, Optional
 import logging
 import traceback
 import asyncio
+import threading
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from transformers import LogitsProcessorList, StoppingCriteriaList
+from model.registry import registry, MODEL_ID
+from model.forking import reset_after_fork
+from model.chunking import Chunk, iter_token_chunks
+from model.scenes import Scene, find_scenes, pack_scenes
+from model.cache import cache_key, get_result_cache
+from model.near_dup import get_near_dup_index
+from model.prefilter import get_prefilter
+from model.workers import WORKER_SETTINGS, get_worker_pool
+from model.distributed import get_coordinator
+from model.scheduler import MAX_BATCH_TOKENS, AdaptiveBatchSizer, BatchScheduler, get_scheduler
+from model.generation import (
+    THOUGHT_OPEN, VERDICT_PATTERN, AnswerStoppingCriteria, DeadlineStoppingCriteria, ThinkingBudgetProcessor, final_answer
+)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Sampled generation runs here, one batch at a time, so it never blocks the event loop
+_generation_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="treat-generate")
+
+@reset_after_fork
+def _new_generation_executor() -> None:
+    """The executor's thread does not survive a fork, so a child needs its own."""
+    global _generation_executor
+    _generation_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="treat-generate")
+
+# Slowest decoding, in new tokens per second per generation batch, that the default deadline allows for
+MIN_DECODE_RATE = float(os.environ.get("TREAT_MIN_DECODE_RATE", "8"))
+
+# How much each verdict counts towards a category's detection threshold
+VERDICT_WEIGHTS = {"YES": 1, "MAYBE": 0.5}
+
+class DetectionTracker:
+    """Running per-category detection counts while chunks are being labeled.
+
+    In detect-only mode a category is settled as soon as its count reaches
+    `threshold`, or can no longer reach it with the entries still unlabeled.
+    Labelers stop scheduling settled categories, so their remaining entries
+    stay None. `on_final` is called once per category with whether it is
+    detected, as soon as that can no longer change.
+    """
+
+    def __init__(
+        self,
+        verdicts: Dict[str, List[Optional[str]]],
+        threshold: float,
+        detect_only: bool = False,
+        on_final: Optional[Callable[[str, bool], None]] = None
+    ):
+        self.verdicts = verdicts
+        self.threshold = threshold
+        self.detect_only = detect_only
+        self.on_final = on_final
+        self.counts = {
+            category: sum(VERDICT_WEIGHTS.get(verdict, 0) for verdict in entries)
+            for category, entries in verdicts.items()
+        }
+        self.remaining = {category: entries.count(None) for category, entries in verdicts.items()}
+        self.final = set()  # categories whose outcome can no longer change
+        for category in verdicts:
+            self._report(category)
+
+    def _report(self, category: str, force: bool = False) -> None:
+        if category in self.final:
+            return
+        if force or self.remaining[category] == 0 or self.settled(category):
+            self.final.add(category)
+            if self.on_final is not None:
+                self.on_final(category, self.counts[category] >= self.threshold)
+
+    def finish(self) -> None:
+        """Report the categories still open, e.g. because some of their batches failed."""
+        for category in self.verdicts:
+            self._report(category, force=True)
+
+    def record(self, category: str, index: int, verdict: str) -> None:
+        """Store a verdict unless the entry already has one."""
+        if self.verdicts[category][index] is not None:
+            return
+        self.verdicts[category][index] = verdict
+        self.counts[category] += VERDICT_WEIGHTS.get(verdict, 0)
+        self.remaining[category] -= 1
+        self._report(category)
+
+    def settled(self, category: str) -> bool:
+        if not self.detect_only:
+            return False
+        count = self.counts[category]
+        return count >= self.threshold or count + self.remaining[category] < self.threshold
+
+    def pending(self, category: str, index: int) -> bool:
+        """Whether the entry still needs the model."""
+        return self.verdicts[category][index] is None and not self.settled(category)
+
+    def unlabeled(self) -> int:
+        """Entries left without a verdict that detect-only did not skip, e.g. because their batch failed."""
+        return sum(
+            entries.count(None) for category, entries in self.verdicts.items() if not self.settled(category)
+        )
+
+def _pad_batch(tokenizer, sequences: List[List[int]]) -> Dict[str, torch.Tensor]:
+    """Left-pad token id sequences into a batch of model inputs."""
+    width = max(len(ids) for ids in sequences)
+    pad_id = tokenizer.pad_token_id
+    return {
+        "input_ids": torch.tensor(
+            [[pad_id] * (width - len(ids)) + ids for ids in sequences],
+            device=registry.device
+        ),
+        "attention_mask": torch.tensor(
+            [[0] * (width - len(ids)) + [1] * len(ids) for ids in sequences],
+            device=registry.device
+        )
+    }
+
+@functools.lru_cache(maxsize=4)
+def _shared_template_ids(tokenizer) -> dict:
+    """Token ids of fixed prompt pieces, shared by every analyzer using `tokenizer`."""
+    return {}
+
+@functools.lru_cache(maxsize=4)
+def _verdict_token_ids(tokenizer) -> Dict[str, List[int]]:
+    """Map each verdict to the first token ids that can start it; computed once per tokenizer."""
+    candidates = {}
+    for verdict in ("YES", "NO", "MAYBE"):
+        ids = set()
+        for variant in (verdict, f" {verdict}", verdict.title(), f" {verdict.title()}"):
+            encoded = tokenizer.encode(variant, add_special_tokens=False)
+            if encoded:
+                ids.add(encoded[0])
+        candidates[verdict] = ids
+    # A token that can start two different verdicts says nothing about either
+    return {
+        verdict: sorted(ids - set().union(*(other for name, other in candidates.items() if name != verdict)))
+        for verdict, ids in candidates.items()
+    }
+
+def _verdicts_from_logits(tokenizer, next_logits: torch.Tensor) -> List[tuple]:
+    """Turn next-token logits (one row per prompt) into (verdict, probability) pairs.
+
+    The probability is renormalized over the three verdicts only.
+    """
+    verdict_ids = _verdict_token_ids(tokenizer)
+    verdicts = list(verdict_ids)
+    next_logits = next_logits.float()
+    scores = torch.stack(
+        [torch.logsumexp(next_logits[:, verdict_ids[verdict]], dim=-1) for verdict in verdicts],
+        dim=-1
+    )
+    probs = torch.softmax(scores, dim=-1)
+    best = probs.argmax(dim=-1)
+    return [(verdicts[i], probs[row, i].item()) for row, i in enumerate(best.tolist())]
+
+def _position_ids(attention_mask: torch.Tensor) -> torch.Tensor:
+    """Positions that start at zero on each row's first real token of a left-padded batch."""
+    return (attention_mask.cumsum(dim=-1) - 1).clamp(min=0)
+
+def _select_past(past_key_values, rows: torch.Tensor):
+    """Gather batch rows of a KV cache, repeating a prefix for each of its suffixes."""
+    if hasattr(past_key_values, "batch_select_indices"):
+        past_key_values.batch_select_indices(rows)
+        return past_key_values
+    return tuple(
+        tuple(tensor[rows] for tensor in layer)
+        for layer in past_key_values
+    )
+
+def _bytes_per_token(model) -> int:
+    """Rough memory one padded token costs in a forward pass: activations plus its KV cache entry."""
+    config = model.config
+    hidden = getattr(config, "hidden_size", 2048)
+    layers = getattr(config, "num_hidden_layers", None) or getattr(config, "num_layers", 32)
+    heads = getattr(config, "num_attention_heads", 32)
+    kv_heads = getattr(config, "num_key_value_heads", None) or heads
+    intermediate = getattr(config, "intermediate_size", 4 * hidden)
+    kv = 2 * layers * kv_heads * (hidden // heads)
+    return (kv + 4 * hidden + intermediate) * next(model.parameters()).element_size()
+
+def _score_prompts(tokenizer, model, sequences: List[List[int]]) -> List[tuple]:
+    """Score complete prompts in one forward pass."""
+    inputs = _pad_batch(tokenizer, sequences)
+    if "logits_to_keep" in inspect.signature(model.forward).parameters:
+        # Skip the vocabulary projection for all but the last position
+        inputs["logits_to_keep"] = 1
+    with torch.no_grad():
+        logits = model(
+            **inputs,
+            position_ids=_position_ids(inputs["attention_mask"]),
+            use_cache=False
+        ).logits
+    # Prompts are left-padded, so every row's next-token logits sit in the last column
+    return _verdicts_from_logits(tokenizer, logits[:, -1])
+
+def _score_batch(sequences: List[List[int]]) -> List[tuple]:
+    """Scheduler runner: score complete prompts from any analysis in one forward pass."""
+    tokenizer, model = registry.get()
+    return _score_prompts(tokenizer, model, sequences)
+
+def _score_shared_prefix_batch(items: List[tuple]) -> List[List[tuple]]:
+    """Scheduler runner: encode each (prefix, suffixes) item's prefix once and score its suffixes on the cache."""
+    tokenizer, model = registry.get()
+    device = registry.device
+    prefix = _pad_batch(tokenizer, [prefix_ids for prefix_ids, _ in items])
+    prefix_mask = prefix["attention_mask"]
+    suffixes = [ids for _, item_suffixes in items for ids in item_suffixes]
+    rows = torch.tensor(
+        [row for row, (_, item_suffixes) in enumerate(items) for _ in item_suffixes],
+        device=device
+    )
+    suffix_length = max(len(ids) for ids in suffixes)
+
+    # Right-pad the suffixes: causal attention keeps pads from reaching real tokens
+    pad_id = tokenizer.pad_token_id
+    input_ids = torch.tensor(
+        [ids + [pad_id] * (suffix_length - len(ids)) for ids in suffixes],
+        device=device
+    )
+    suffix_mask = torch.tensor(
+        [[1] * len(ids) + [0] * (suffix_length - len(ids)) for ids in suffixes],
+        device=device
+    )
+    attention_mask = torch.cat([prefix_mask[rows], suffix_mask], dim=1)
+    position_ids = prefix_mask.sum(dim=1)[rows, None] + torch.arange(suffix_length, device=device)[None, :]
+
+    with torch.no_grad():
+        past = model(
+            **prefix,
+            position_ids=_position_ids(prefix_mask),
+            use_cache=True
+        ).past_key_values
+        logits = model(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            position_ids=position_ids,
+            past_key_values=_select_past(past, rows),
+            use_cache=True
+        ).logits
+
+    last = torch.tensor([len(ids) - 1 for ids in suffixes], device=device)
+    scored = _verdicts_from_logits(tokenizer, logits[torch.arange(len(suffixes), device=device), last])
+    results = []
+    position = 0
+    for _, item_suffixes in items:
+        results.append(scored[position:position + len(item_suffixes)])
+        position += len(item_suffixes)
+    return results
+
+def _scheduler(name: str, runner) -> BatchScheduler:
+    """Process-wide scheduler whose batch budget adapts to throughput and free memory."""
+    return get_scheduler(
+        name,
+        runner,
+        make_sizer=lambda: AdaptiveBatchSizer(
+            MAX_BATCH_TOKENS,
+            bytes_per_token=_bytes_per_token(registry.get()[1]),
+            memory_probe=registry.available_memory
+        )
+    )
+
 class ContentAnalyzer:
     def __init__(self):
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.device = registry.device
         self.model = None
         self.tokenizer = None
-        self.batch_size = 2  # Reduced batch size for deeper thinking
-        self.max_thinking_time = 30  # Maximum seconds per batch for reasoning
+        self.batch_size = 2  # Reduced batch size for deeper thinking; logit scoring is batched by the scheduler instead
+        # Deadline in seconds for each generation batch, enforced while decoding; None allows the batch's
+        # token budget at `min_decode_rate`, so the deadline grows with `thinking_budget`
+        self.max_thinking_time = None
+        self.min_decode_rate = MIN_DECODE_RATE
+        self.thinking_budget = 480  # Reasoning tokens before the closing </thought> is forced in "generate" mode
+        self.answer_tokens = 20  # Tokens left for the final answer after the reasoning
+        self.chunk_tokens = 1024  # Upper bound on script tokens per chunk, further capped by the context window
+        self.chunk_overlap_tokens = 32
+        self.verdict_mode = "score"  # "score": one forward pass over YES/NO/MAYBE logits, "generate": sample a response
+        # "multi_label": one prompt per chunk covering every category
+        # "shared_prefix": encode each chunk once and branch its KV cache per category (always logit-scored)
+        self.prompt_mode = "per_category"
+        self._suffix_ids = None
+        self.use_cache = True  # Reuse verdicts for chunk text seen before, in memory and on disk
+        self.result_cache = get_result_cache()
+        self.near_dup_threshold = 0.9  # Minimum estimated Jaccard similarity to reuse a near-duplicate's verdicts; None disables
+        self.near_dup_index = None  # opened off the event loop on first use
+        # Fraction of chunks that must be flagged before a category is reported
+        self.detection_ratio = 0.1
+        # Stop labeling a category once whether it is reported is certain; per-chunk verdicts are then partial
+        self.detect_only = False
+        # Called with (mapped name, detected) as soon as a category's outcome is final, before the whole run ends
+        self.on_category = None
+        self.unlabeled_checks = 0  # Entries the last classify_chunks call left without a verdict
         self.trigger_categories = {
             "Violence": {
                 "mapped_name": "Violence",
@@ -53,178 +337,790 @@ class ContentAnalyzer:
                 "description": "Psychological distress, mental disorders, or emotional trauma."
             }
         }
+        # Label through remote workers (TREAT_COORDINATOR) or the TREAT_WORKERS process pool when configured
+        self.use_workers = True
+        self.worker_job_chunks = 8  # Chunks per job sent to a worker process
+        # Cheap evidence check in front of the model (TREAT_PREFILTER); None sends every check to the model
+        self.prefilter = get_prefilter(self.trigger_categories)
         logger.info(f"Initialized analyzer with device: {self.device}")
 
+    @property
+    def max_new_tokens(self) -> int:
+        """Response budget in "generate" mode: the reasoning plus the final answer."""
+        return self.thinking_budget + self.answer_tokens
+
     async def load_model(self, progress=None) -> None:
-        """Load the model and tokenizer with progress updates."""
-        try:
-            if progress:
-                progress(0.1, "Loading tokenizer...")
-            
-            self.tokenizer = AutoTokenizer.from_pretrained(
-                "LGAI-EXAONE/EXAONE-Deep-2.4B",
-                use_fast=True,
-                trust_remote_code=True
+        """Attach the process-wide warm model, loading it on first use without blocking the event loop."""
+        loop = asyncio.get_running_loop()
+        self.tokenizer, self.model = await loop.run_in_executor(None, registry.get, progress)
+
+    def _prompt_template(self, layout: str, category: Optional[str] = None) -> tuple:
+        """Head and tail text wrapped around a chunk's tokens for a prompt layout."""
+        if layout == "multi_label":
+            definitions = "\n".join(
+                f"- {key}: {info['description']}"
+                for key, info in self.trigger_categories.items()
             )
-            
-            if progress:
-                progress(0.3, "Loading model...")
-            
-            self.model = AutoModelForCausalLM.from_pretrained(
-                "LGAI-EXAONE/EXAONE-Deep-2.4B",
-                torch_dtype=torch.float16 if self.device == "cuda" else torch.float32,
-                device_map="auto",
-                trust_remote_code=True
+            return (
+                f"Analyze the content for each category below.\n{definitions}\nContent: \"",
+                "\".\nFor every category answer on its own line as \"Category: YES/NO/MAYBE\" based on clear evidence."
             )
-            
-            if self.device == "cuda":
-                self.model.eval()
-                torch.cuda.empty_cache()
-                
-            if progress:
-                progress(0.5, "Model loaded successfully")
-                
-        except Exception as e:
-            logger.error(f"Error loading model: {str(e)}")
+        if layout == "shared_prefix":
+            return "Content: \"", "\".\n"
+
+        info = self.trigger_categories[category]
+        tail = "\". Answer YES/NO/MAYBE based on clear evidence."
+        if self.verdict_mode == "score":
+            tail += "\nAnswer:"
+        return f"Analyze text for {info['mapped_name']}. Definition: {info['description']}. Content: \"", tail
+
+    @property
+    def _template_ids(self) -> dict:
+        return _shared_template_ids(self.tokenizer)
+
+    def _encode_template(self, text: str) -> List[int]:
+        """Token ids of a fixed piece of prompt text, cached per tokenizer."""
+        if text not in self._template_ids:
+            self._template_ids[text] = self.tokenizer.encode(text, add_special_tokens=False)
+        return self._template_ids[text]
+
+    def _special_prefix_ids(self) -> List[int]:
+        """Special tokens the tokenizer puts in front of every sequence (e.g. BOS)."""
+        if None not in self._template_ids:
+            bos = self.tokenizer.bos_token_id
+            specials = self.tokenizer.encode("", add_special_tokens=True)
+            self._template_ids[None] = [bos] if bos is not None and specials[:1] == [bos] else []
+        return self._template_ids[None]
+
+    def _chat_template_ids(self) -> Optional[tuple]:
+        """Token ids the chat template puts before and after a user message, or None without a template.
+
+        EXAONE-Deep's template ends by opening a `<thought>` section; the third
+        element says whether it does.
+        """
+        if "chat" not in self._template_ids:
+            wrapped = None
+            if getattr(self.tokenizer, "chat_template", None):
+                placeholder = "\0"
+                text = self.tokenizer.apply_chat_template(
+                    [{"role": "user", "content": placeholder}],
+                    tokenize=False,
+                    add_generation_prompt=True
+                )
+                before, after = text.split(placeholder, 1)
+                # The rendered template already spells out BOS, so do not add it again
+                wrapped = (
+                    self.tokenizer.encode(before, add_special_tokens=False),
+                    self.tokenizer.encode(after, add_special_tokens=False),
+                    after.rstrip().endswith(THOUGHT_OPEN)
+                )
+            self._template_ids["chat"] = wrapped
+        return self._template_ids["chat"]
+
+    def _generates(self, layout: str) -> bool:
+        """Whether prompts of this layout are answered by generation rather than logit scoring."""
+        return layout == "multi_label" or (layout == "per_category" and self.verdict_mode == "generate")
+
+    def _prompt_ids(self, chunk: Chunk, layout: str, category: Optional[str] = None) -> List[int]:
+        """Assemble a prompt around the chunk's existing token ids instead of re-tokenizing it.
+
+        Generated prompts go through the chat template so the model reasons in its
+        usual format before answering.
+        """
+        head, tail = self._prompt_template(layout, category)
+        body = self._encode_template(head) + chunk.token_ids + self._encode_template(tail)
+        chat = self._chat_template_ids() if self._generates(layout) else None
+        if chat:
+            before, after, _ = chat
+            return before + body + after
+        return self._special_prefix_ids() + body
+
+    def _pad_batch(self, sequences: List[List[int]]) -> Dict[str, torch.Tensor]:
+        """Left-pad token id sequences into a batch of model inputs."""
+        return _pad_batch(self.tokenizer, sequences)
+
+    def _context_length(self) -> int:
+        """Longest sequence the model accepts, from its config or the tokenizer."""
+        limits = [
+            getattr(self.model.config, "max_position_embeddings", None),
+            self.tokenizer.model_max_length
+        ]
+        # Tokenizers without a known limit report a huge sentinel value
+        limits = [limit for limit in limits if limit and limit < 1_000_000]
+        return min(limits) if limits else 4096
+
+    def _chunk_token_budget(self) -> int:
+        """Script tokens per chunk that still leave room for the prompt template and the answer."""
+        empty = Chunk(0, "", [], 0, 0)
+        if self.prompt_mode == "per_category":
+            template = max(len(self._prompt_ids(empty, "per_category", category)) for category in self.trigger_categories)
+        else:
+            template = len(self._prompt_ids(empty, self.prompt_mode))
+        if self.prompt_mode == "shared_prefix":
+            template += max(len(ids) for ids in self._category_suffix_ids().values())
+
+        if self.prompt_mode == "multi_label":
+            answer = self.thinking_budget + 12 * len(self.trigger_categories)
+        elif self.verdict_mode == "generate" and self.prompt_mode == "per_category":
+            answer = self.max_new_tokens
+        else:
+            answer = 1
+
+        budget = min(self.chunk_tokens, self._context_length() - template - answer)
+        return max(budget, self.chunk_overlap_tokens + 1)
+
+    def _chunk_text(self, text: str, scenes: Optional[List[Scene]] = None) -> Iterator[Chunk]:
+        """Split text into chunks that fit the model's prompt budget.
+
+        Screenplays with scene headings are packed scene by scene; anything else
+        is cut into overlapping token windows.
+        """
+        budget = self._chunk_token_budget()
+        if scenes and len(scenes) > 1:
+            return pack_scenes(text, scenes, self.tokenizer, budget, self.chunk_overlap_tokens)
+        return iter_token_chunks(text, self.tokenizer, budget, self.chunk_overlap_tokens)
+
+    def _validate_response(self, response: str) -> Optional[str]:
+        """Take the first YES/NO/MAYBE of the final answer, ignoring the reasoning before it.
+
+        None when the answer has no verdict, so the entry is neither counted nor cached.
+        """
+        match = VERDICT_PATTERN.search(final_answer(response).upper())
+        return match.group(1) if match else None
+
+    def _decode_response(self, ids: torch.Tensor) -> str:
+        """Decode generated tokens, keeping the thought tags but dropping padding and end markers."""
+        text = self.tokenizer.decode(ids, skip_special_tokens=False)
+        for token in {self.tokenizer.pad_token, self.tokenizer.eos_token, self.tokenizer.bos_token}:
+            if token:
+                text = text.replace(token, "")
+        return text
+
+    def _score_prompts(self, sequences: List[List[int]]) -> List[tuple]:
+        """Score complete prompts with the attached model in one forward pass."""
+        return _score_prompts(self.tokenizer, self.model, sequences)
+
+    def _category_suffix_ids(self) -> Dict[str, List[int]]:
+        """Token ids of the short per-category question asked after a shared chunk prefix."""
+        if self._suffix_ids is None:
+            self._suffix_ids = {
+                category: self.tokenizer.encode(
+                    f"Analyze the content above for {info['mapped_name']}. Definition: {info['description']}. "
+                    "Answer YES/NO/MAYBE based on clear evidence.\nAnswer:",
+                    add_special_tokens=False
+                )
+                for category, info in self.trigger_categories.items()
+            }
+        return self._suffix_ids
+
+    def _generation_deadline(self, max_new_tokens: int) -> float:
+        """Seconds a generation batch of up to `max_new_tokens` may take."""
+        if self.max_thinking_time is not None:
+            return self.max_thinking_time
+        return max_new_tokens / self.min_decode_rate
+
+    async def _generate_outputs(self, inputs, is_complete=None, **overrides):
+        """Generate on the dedicated inference thread, stopping at the generation deadline.
+
+        Each row stops as soon as its final answer satisfies `is_complete` (by
+        default: it contains a verdict), and a row still reasoning after
+        `thinking_budget` tokens has its thought closed for it. The event loop
+        stays free while the model decodes. If the awaiting task is cancelled,
+        decoding stops at the next token instead of running to the end.
+        """
+        cancelled = threading.Event()
+        chat = self._chat_template_ids()
+        answers = AnswerStoppingCriteria(
+            self.tokenizer,
+            prompt_length=inputs["input_ids"].shape[1],
+            thinking=bool(chat and chat[2]),
+            is_complete=is_complete or (lambda answer: VERDICT_PATTERN.search(answer.upper()) is not None)
+        )
+        stopping = StoppingCriteriaList([
+            DeadlineStoppingCriteria(
+                time.monotonic() + self._generation_deadline(overrides.get("max_new_tokens", self.max_new_tokens)),
+                cancelled
+            ),
+            answers
+        ])
+        processors = LogitsProcessorList([ThinkingBudgetProcessor(answers, self.thinking_budget)])
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(
+                _generation_executor,
+                functools.partial(self._generate_sync, inputs, stopping, processors, **overrides)
+            )
+        except asyncio.CancelledError:
+            cancelled.set()
             raise
 
-    def _chunk_text(self, text: str, chunk_size: int = 20000, overlap: int = 100) -> List[str]:
-        """Split text into overlapping chunks."""
-        words = text.split()
-        chunks = []
-        for i in range(0, len(words), chunk_size - overlap):
-            chunk = ' '.join(words[i:i + chunk_size])
-            chunks.append(chunk)
-        return chunks
-
-    def _validate_response(self, response: str) -> str:
-        """Validate and clean model response."""
-        valid_responses = {"YES", "NO", "MAYBE"}
-        response = response.strip().upper()
-        first_word = response.split()[0] if response else "NO"
-        return first_word if first_word in valid_responses else "NO"
-
-    async def _generate_outputs(self, inputs):
+    def _generate_sync(self, inputs, stopping_criteria: StoppingCriteriaList, logits_processor: LogitsProcessorList, **overrides):
         """Helper method to generate outputs with torch.no_grad()."""
+        generation_kwargs = dict(
+            max_new_tokens=self.max_new_tokens,
+            temperature=0.3,   # Lower temperature for more focused responses
+            top_p=0.95,       # Slightly higher to ensure valid responses
+            top_k=10,         # Reduced to limit vocabulary to relevant tokens
+            pad_token_id=self.tokenizer.eos_token_id,
+            do_sample=True    # Keep sampling for slight variation
+        )
+        generation_kwargs.update(overrides)
+        if not generation_kwargs["do_sample"]:
+            for key in ("temperature", "top_p", "top_k"):
+                generation_kwargs.pop(key)
+
         with torch.no_grad():
             outputs = self.model.generate(
                 **inputs,
-                max_new_tokens=500, 
-                temperature=0.3,   # Lower temperature for more focused responses
-                top_p=0.95,       # Slightly higher to ensure valid responses
-                top_k=10,         # Reduced to limit vocabulary to relevant tokens
-                pad_token_id=self.tokenizer.eos_token_id,
-                do_sample=True    # Keep sampling for slight variation
+                stopping_criteria=stopping_criteria,
+                logits_processor=logits_processor,
+                **generation_kwargs
             )
+        if stopping_criteria[0].expired:
+            # Truncated rows carry no trustworthy verdict; the batch's entries stay unlabeled
+            raise TimeoutError("Generation stopped at its deadline before every row answered")
         return outputs
 
-    async def analyze_chunks_batch(
-        self,
-        chunks: List[str],
-        progress: Optional[gr.Progress] = None,
-        current_progress: float = 0,
-        progress_step: float = 0
-    ) -> Dict[str, float]:
-        """Analyze multiple chunks in batches."""
-        all_triggers = {}
-        
+    def _parse_multi_label(self, response: str) -> Dict[str, str]:
+        """Parse "Category: VERDICT" lines, accepting either the key or the mapped name."""
+        def normalize(name: str) -> str:
+            return re.sub(r"[^a-z]", "", name.lower())
+
+        lookup = {}
+        for category, info in self.trigger_categories.items():
+            lookup[normalize(category)] = category
+            lookup[normalize(info["mapped_name"])] = category
+
+        labels = {}
+        for match in re.finditer(r"^[\s\-*\d.]*([A-Za-z][A-Za-z _\-]*?)\**\s*[:=\-]\s*\**\s*(YES|NO|MAYBE)\b", response, re.IGNORECASE | re.MULTILINE):
+            category = lookup.get(normalize(match.group(1)))
+            if category and category not in labels:
+                labels[category] = match.group(2).upper()
+        return labels
+
+    async def _label_in_workers(self, pool, chunks: List[Chunk], tracker: DetectionTracker, advance) -> None:
+        """Label the still-pending entries through worker processes or remote workers, in chunk-category jobs.
+
+        Per-category prompts get one job per category and run of chunks; layouts
+        that ask about several categories at once keep them together in a job.
+        """
+        settings = {name: getattr(self, name) for name in WORKER_SETTINGS}
+        groups = (
+            [[category] for category in self.trigger_categories]
+            if self.prompt_mode == "per_category"
+            else [list(self.trigger_categories)]
+        )
+
+        async def run(indices: List[int], categories: List[str]) -> tuple:
+            job = {
+                "chunks": [chunks[index] for index in indices],
+                "categories": {category: self.trigger_categories[category] for category in categories},
+                "settings": settings
+            }
+            try:
+                return indices, categories, await pool.run(job)
+            except Exception as e:
+                logger.error(f"Worker job for chunks {indices[0]}-{indices[-1]} failed: {str(e)}")
+                return indices, categories, {}
+
+        def handle(result: tuple) -> None:
+            indices, categories, verdicts = result
+            for category, labels in verdicts.items():
+                for index, verdict in zip(indices, labels):
+                    if verdict is not None:
+                        tracker.record(category, index, verdict)
+            advance(len(indices) * len(categories), "Analyzing in worker processes...")
+
+        tasks = {}
+        for categories in groups:
+            pending = [
+                index for index in range(len(chunks))
+                if any(tracker.pending(category, index) for category in categories)
+            ]
+            for i in range(0, len(pending), self.worker_job_chunks):
+                indices = pending[i:i + self.worker_job_chunks]
+                tasks[asyncio.ensure_future(run(indices, categories))] = categories
+        await self._collect(tasks, tracker, handle, advance)
+
+    async def _label_multi(self, chunks: List[Chunk], tracker: DetectionTracker, advance) -> None:
+        """Label chunks with one generation per chunk covering all categories.
+
+        Categories missing from or malformed in a response stay None so the caller
+        falls back to per-category prompts for them.
+        """
+        max_new_tokens = self.thinking_budget + 12 * len(self.trigger_categories)
+        complete = lambda answer: len(self._parse_multi_label(answer)) == len(self.trigger_categories)
+        needs_model = lambda index: any(tracker.pending(category, index) for category in self.trigger_categories)
+        # Batch chunks of similar length together so short ones are not padded to long ones
+        pending = sorted(filter(needs_model, range(len(chunks))), key=lambda index: len(chunks[index]))
+        for i in range(0, len(pending), self.batch_size):
+            batch_indices = [index for index in pending[i:i + self.batch_size] if needs_model(index)]
+            if not batch_indices:
+                advance(min(self.batch_size, len(pending) - i) * len(self.trigger_categories), "Skipping settled categories...")
+                continue
+            try:
+                inputs = self._pad_batch([self._prompt_ids(chunks[index], "multi_label") for index in batch_indices])
+
+                outputs = await self._generate_outputs(
+                    inputs, is_complete=complete, max_new_tokens=max_new_tokens, do_sample=False
+                )
+                prompt_length = inputs["input_ids"].shape[1]
+                for index, output in zip(batch_indices, outputs):
+                    labels = self._parse_multi_label(final_answer(self._decode_response(output[prompt_length:])))
+                    for category, verdict in labels.items():
+                        tracker.record(category, index, verdict)
+                    missing = len(self.trigger_categories) - len(labels)
+                    if missing:
+                        logger.info(f"Multi-label response for chunk {index} missing {missing} categories, falling back")
+
+            except Exception as e:
+                logger.error(f"Error processing multi-label batch at chunk {batch_indices[0]}: {str(e)}")
+
+            advance(min(self.batch_size, len(pending) - i) * len(self.trigger_categories), "Analyzing all categories...")
+
+    @staticmethod
+    async def _collect(tasks: Dict[asyncio.Future, List[str]], tracker: DetectionTracker, handle, advance) -> None:
+        """Hand finished jobs to `handle` as they complete, cancelling jobs whose categories all settled.
+
+        `tasks` maps each job to the categories it labels.
+        """
+        try:
+            while tasks:
+                done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    tasks.pop(task)
+                    handle(task.result())
+                settled = [
+                    task for task, categories in tasks.items()
+                    if all(tracker.settled(category) for category in categories)
+                ]
+                for task in settled:
+                    task.cancel()
+                    advance(len(tasks.pop(task)), "Skipping settled categories...")
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _label_shared_prefix(self, chunks: List[Chunk], tracker: DetectionTracker, advance) -> None:
+        """Label chunks by running each chunk once as a cached prefix for every category question.
+
+        Chunks go through the process-wide scheduler, so prefixes from concurrent
+        analyses share forward passes.
+        """
+        scheduler = _scheduler("shared_prefix", _score_shared_prefix_batch)
+        suffix_ids = self._category_suffix_ids()
+        suffix_length = max(len(ids) for ids in suffix_ids.values())
+
+        async def score(index: int, categories: List[str]) -> tuple:
+            prefix = self._prompt_ids(chunks[index], "shared_prefix")
+            # Every category question keeps its own copy of the prefix cache
+            tokens = (len(prefix) + suffix_length) * len(categories)
+            try:
+                scored = await scheduler.run((prefix, [suffix_ids[category] for category in categories]), tokens)
+                return index, categories, dict(zip(categories, scored))
+            except Exception as e:
+                logger.error(f"Error processing shared prefix for chunk {index}: {str(e)}")
+                return index, categories, {}
+
+        def handle(result: tuple) -> None:
+            index, categories, scored = result
+            for category, (verdict, probability) in scored.items():
+                logger.debug(f"{category}: {verdict} (p={probability:.2f})")
+                tracker.record(category, index, verdict)
+            advance(len(categories), "Analyzing all categories...")
+
+        tasks = {}
+        for index in range(len(chunks)):
+            categories = [category for category in self.trigger_categories if tracker.pending(category, index)]
+            if categories:
+                tasks[asyncio.ensure_future(score(index, categories))] = categories
+        await self._collect(tasks, tracker, handle, advance)
+
+    async def _label_scored(self, chunks: List[Chunk], tracker: DetectionTracker, advance) -> None:
+        """Label the still-pending entries by logit scoring through the process-wide scheduler."""
+        scheduler = _scheduler("score", _score_batch)
+
+        async def score(category: str, index: int) -> tuple:
+            prompt = self._prompt_ids(chunks[index], "per_category", category)
+            try:
+                return category, index, await scheduler.run(prompt, len(prompt))
+            except Exception as e:
+                logger.error(f"Error processing chunk {index} for {self.trigger_categories[category]['mapped_name']}: {str(e)}")
+                return category, index, None
+
+        def handle(result: tuple) -> None:
+            category, index, scored = result
+            mapped_name = self.trigger_categories[category]["mapped_name"]
+            if scored:
+                verdict, probability = scored
+                logger.debug(f"{mapped_name}: {verdict} (p={probability:.2f})")
+                tracker.record(category, index, verdict)
+            advance(1, f"Analyzing {mapped_name}...")
+
+        tasks = {
+            asyncio.ensure_future(score(category, index)): [category]
+            for category in self.trigger_categories
+            for index in range(len(chunks))
+            if tracker.pending(category, index)
+        }
+        await self._collect(tasks, tracker, handle, advance)
+
+    async def _label_per_category(self, chunks: List[Chunk], tracker: DetectionTracker, advance) -> None:
+        """Label the still-pending entries with one prompt per chunk and category."""
+        if self.verdict_mode == "score":
+            await self._label_scored(chunks, tracker, advance)
+            return
+
         for category, info in self.trigger_categories.items():
             mapped_name = info["mapped_name"]
-            description = info["description"]
-            
-            for i in range(0, len(chunks), self.batch_size):
-                batch_chunks = chunks[i:i + self.batch_size]
-                prompts = []
-                
-                for chunk in batch_chunks:
-                    prompt = f"Analyze text for {mapped_name}. Definition: {description}. Content: \"{chunk}\". Answer YES/NO/MAYBE based on clear evidence."
-                    prompts.append(prompt)
+            pending = sorted(
+                (index for index in range(len(chunks)) if tracker.pending(category, index)),
+                key=lambda index: len(chunks[index])
+            )
+
+            for i in range(0, len(pending), self.batch_size):
+                if tracker.settled(category):
+                    advance(len(pending) - i, f"Skipping {mapped_name}...")
+                    break
+                batch_indices = pending[i:i + self.batch_size]
 
                 try:
-                    inputs = self.tokenizer(
-                        prompts,
-                        return_tensors="pt",
-                        padding=True,
-                        truncation=True,
-                        max_length=512
-                    ).to(self.device)
-                    
-                    outputs = await asyncio.wait_for(
-                    self._generate_outputs(inputs),
-                    timeout=self.max_thinking_time
-                )
-                    
-                    responses = [
-                        self.tokenizer.decode(output, skip_special_tokens=True)
+                    inputs = self._pad_batch(
+                        [self._prompt_ids(chunks[index], "per_category", category) for index in batch_indices]
+                    )
+
+                    outputs = await self._generate_outputs(inputs)
+                    prompt_length = inputs["input_ids"].shape[1]
+                    batch_verdicts = [
+                        self._validate_response(self._decode_response(output[prompt_length:]))
                         for output in outputs
                     ]
-                    
-                    for response in responses:
-                        validated_response = self._validate_response(response)
-                        if validated_response == "YES":
-                            all_triggers[mapped_name] = all_triggers.get(mapped_name, 0) + 1
-                        elif validated_response == "MAYBE":
-                            all_triggers[mapped_name] = all_triggers.get(mapped_name, 0) + 0.5
+
+                    for index, verdict in zip(batch_indices, batch_verdicts):
+                        if verdict is not None:
+                            tracker.record(category, index, verdict)
                 
-                except asyncio.TimeoutError:
-                    logger.error(f"Timeout processing batch for {mapped_name}")
-                    continue
                 except Exception as e:
                     logger.error(f"Error processing batch for {mapped_name}: {str(e)}")
-                    continue
                 
-                if progress:
-                    current_progress += progress_step
-                    progress(min(current_progress, 0.9), f"Analyzing {mapped_name}...")
-                    
+                advance(len(batch_indices), f"Analyzing {mapped_name}...")
+
+    async def classify_chunks(
+        self,
+        chunks: List[Chunk],
+        progress: Optional[gr.Progress] = None,
+        current_progress: float = 0,
+        progress_step: float = 0
+    ) -> Dict[str, List[Optional[str]]]:
+        """Return the YES/NO/MAYBE verdict of every chunk, per category.
+
+        Entries are None where a batch failed or, with `detect_only`, where the
+        category was already settled.
+        """
+        verdicts = {category: [None] * len(chunks) for category in self.trigger_categories}
+        keys = {}
+        if self.use_cache:
+            signature = self._decoding_signature()
+            keys = {
+                (category, index): cache_key(chunk.text, category, info["description"], MODEL_ID, signature)
+                for category, info in self.trigger_categories.items()
+                for index, chunk in enumerate(chunks)
+            }
+            cached = self.result_cache.get_many(keys.values())
+            for (category, index), key in keys.items():
+                verdicts[category][index] = cached.get(key)
+            hits = len(cached)
+            if hits:
+                # Chunks of a revised script that kept their boundaries come back whole
+                unchanged = sum(
+                    1 for index in range(len(chunks))
+                    if all(verdicts[category][index] is not None for category in self.trigger_categories)
+                )
+                logger.info(
+                    f"Reused {hits}/{len(keys)} cached verdicts; "
+                    f"{len(chunks) - unchanged}/{len(chunks)} chunks need the model"
+                )
+                if progress is not None:
+                    current_progress += progress_step * hits
+
+        near_duplicates = set()
+        signatures = {}
+        if self.near_dup_threshold is not None:
+            if self.near_dup_index is None:
+                self.near_dup_index = await asyncio.get_running_loop().run_in_executor(None, get_near_dup_index)
+            namespace = self._near_dup_namespace()
+            for index, chunk in enumerate(chunks):
+                missing = [category for category in self.trigger_categories if verdicts[category][index] is None]
+                if not missing:
+                    continue
+                signatures[index] = self.near_dup_index.signature(chunk.text)
+                match = self.near_dup_index.query(signatures[index], namespace, self.near_dup_threshold)
+                if match and all(category in match[0] for category in missing):
+                    stored, similarity = match
+                    for category in missing:
+                        verdicts[category][index] = stored[category]
+                    near_duplicates.add(index)
+                    logger.debug(f"Chunk {index} reuses verdicts of a near-duplicate (similarity {similarity:.2f})")
+                    if progress is not None:
+                        current_progress += progress_step * len(missing)
+            if signatures:
+                stats = self.near_dup_index.stats()
+                logger.info(
+                    f"Near-duplicate reuse for {len(near_duplicates)}/{len(signatures)} chunks "
+                    f"(index hit rate {stats['hit_rate']:.1%} over {stats['lookups']} lookups)"
+                )
+
+        # Checks without any lexical or embedding evidence are answered NO without the model
+        filtered = set()
+        audited = set()
+        screened = set()
+        if self.prefilter is not None:
+            pending = {
+                index: [category for category in self.trigger_categories if verdicts[category][index] is None]
+                for index in range(len(chunks))
+            }
+            pending = {index: categories for index, categories in pending.items() if categories}
+            if pending:
+                loop = asyncio.get_running_loop()
+                results = await loop.run_in_executor(
+                    None, self.prefilter.screen, [chunks[index].text for index in pending], list(pending.values())
+                )
+                screened = {(category, index) for index, categories in pending.items() for category in categories}
+                for index, (skipped, sampled) in zip(pending, results):
+                    for category in skipped:
+                        verdicts[category][index] = "NO"
+                        filtered.add((category, index))
+                    audited.update((category, index) for category in sampled)
+                if progress is not None:
+                    current_progress += progress_step * len(filtered)
+
+        on_final = None
+        if self.on_category is not None:
+            on_final = lambda category, detected: self.on_category(self.trigger_categories[category]["mapped_name"], detected)
+        tracker = DetectionTracker(verdicts, self._chunk_threshold(len(chunks)), self.detect_only, on_final)
+
+        # Throughput and ETA only count the checks left for the model
+        total_checks = sum(tracker.remaining.values())
+        pending_tokens = sum(
+            len(chunk) * sum(entries[index] is None for entries in verdicts.values())
+            for index, chunk in enumerate(chunks)
+        )
+        tokens_per_check = pending_tokens / total_checks if total_checks else 0
+        checks_done = 0
+        started = time.monotonic()
+
+        def advance(units: int, status: str) -> None:
+            nonlocal current_progress, checks_done
+            checks_done = min(total_checks, checks_done + units)
+            if progress is not None:
+                current_progress += progress_step * units
+                elapsed = time.monotonic() - started
+                rate = checks_done / elapsed if elapsed > 0 else 0
+                details = (
+                    f"{checks_done}/{total_checks} chunk checks, "
+                    f"{len(tracker.final)}/{len(verdicts)} categories done, "
+                    f"{rate * tokens_per_check:.0f} tokens/s"
+                )
+                if rate:
+                    details += f", ETA {(total_checks - checks_done) / rate:.0f}s"
+                progress(min(current_progress, 0.9), f"{status} ({details})")
+        pool = None
+        if self.use_workers:
+            pool = get_coordinator() or await asyncio.get_running_loop().run_in_executor(None, get_worker_pool)
+        if pool is not None:
+            await self._label_in_workers(pool, chunks, tracker, advance)
+        elif self.prompt_mode == "multi_label":
+            await self._label_multi(chunks, tracker, advance)
+            # Progress for fallback prompts is already accounted for above
+            advance = lambda units, status: None
+        elif self.prompt_mode == "shared_prefix":
+            await self._label_shared_prefix(chunks, tracker, advance)
+            advance = lambda units, status: None
+
+        if pool is None:
+            await self._label_per_category(chunks, tracker, advance)
+        tracker.finish()
+        self.unlabeled_checks = tracker.unlabeled()
+        if self.unlabeled_checks:
+            logger.warning(f"{self.unlabeled_checks}/{len(chunks) * len(verdicts)} chunk-category checks got no verdict")
+        if self.detect_only:
+            skipped = sum(entries.count(None) for entries in verdicts.values())
+            logger.info(f"Detect-only: skipped {skipped}/{len(chunks) * len(verdicts)} chunk-category checks")
+
+        # The model's verdicts on screened checks tell how much the filter misses
+        for category, index in screened - filtered:
+            self.prefilter.record(verdicts[category][index], (category, index) in audited)
+        if screened:
+            stats = self.prefilter.stats()
+            recall = stats["estimated_recall"]
+            logger.info(
+                f"Pre-filter skipped {len(filtered)}/{len(screened)} checks and audited {len(audited)} "
+                f"(overall skip rate {stats['skip_rate']:.1%}, estimated recall "
+                f"{'n/a' if recall is None else f'{recall:.1%}'})"
+            )
+
+        # Only the model's own verdicts are stored; filtered NOs are cheap to recompute
+        if self.use_cache:
+            self.result_cache.put_many({
+                key: verdicts[category][index]
+                for (category, index), key in keys.items()
+                if verdicts[category][index] is not None and key not in cached and index not in near_duplicates
+                and (category, index) not in filtered
+            })
+        filtered_chunks = {index for _, index in filtered}
+        for index, signature in signatures.items():
+            labels = {category: verdicts[category][index] for category in self.trigger_categories}
+            if index not in near_duplicates and index not in filtered_chunks and None not in labels.values():
+                self.near_dup_index.add(signature, namespace, labels)
+        return verdicts
+
+    def _near_dup_namespace(self) -> str:
+        """Verdicts are only reused between chunks analyzed with the same model, prompts and definitions."""
+        return cache_key(
+            MODEL_ID,
+            self._decoding_signature(),
+            *(f"{category}:{info['description']}" for category, info in self.trigger_categories.items())
+        )
+
+    def _decoding_signature(self) -> str:
+        """Settings that change a verdict for the same chunk text, used in cache keys."""
+        settings = [self.verdict_mode, self.prompt_mode]
+        if registry.backend in ("bf16", "int8"):
+            # Reduced-precision backends can flip borderline verdicts
+            settings.append(f"backend={registry.backend}")
+        if self.verdict_mode == "generate" or self.prompt_mode == "multi_label":
+            settings.append(f"thinking_budget={self.thinking_budget}")
+            settings.append(f"max_new_tokens={self.max_new_tokens}")
+        return "|".join(settings)
+
+    def _chunk_threshold(self, chunk_count: int) -> float:
+        """Detections a category needs before it is reported."""
+        return max(1, chunk_count * self.detection_ratio)
+
+    def _tally(self, verdicts: Dict[str, List[Optional[str]]]) -> Dict[str, float]:
+        """Count YES as one and MAYBE as half a detection per category."""
+        all_triggers = {}
+        for category, info in self.trigger_categories.items():
+            mapped_name = info["mapped_name"]
+            for validated_response in verdicts[category]:
+                if validated_response in VERDICT_WEIGHTS:
+                    all_triggers[mapped_name] = all_triggers.get(mapped_name, 0) + VERDICT_WEIGHTS[validated_response]
         return all_triggers
 
-    async def analyze_script(self, script: str, progress: Optional[gr.Progress] = None) -> List[str]:
-        """Analyze the entire script."""
+    def _scene_timeline(self, scenes: List[Scene], chunks: List[Chunk], verdicts: Dict[str, List[Optional[str]]]) -> List[dict]:
+        """Attribute chunk verdicts to the scenes each chunk covers, strongest verdict winning."""
+        strength = {"MAYBE": 1, "YES": 2}
+        flagged = {}
+        for category, info in self.trigger_categories.items():
+            for chunk, verdict in zip(chunks, verdicts[category]):
+                if verdict not in strength:
+                    continue
+                for scene_index in chunk.scenes:
+                    scene_triggers = flagged.setdefault(scene_index, {})
+                    current = scene_triggers.get(info["mapped_name"])
+                    if current is None or strength[verdict] > strength[current]:
+                        scene_triggers[info["mapped_name"]] = verdict
+
+        return [
+            {"scene": scene_index, "heading": scenes[scene_index].heading, "triggers": flagged[scene_index]}
+            for scene_index in sorted(flagged)
+        ]
+
+    async def analyze_chunks_batch(
+        self,
+        chunks: List[Chunk],
+        progress: Optional[gr.Progress] = None,
+        current_progress: float = 0,
+        progress_step: float = 0
+    ) -> Dict[str, float]:
+        """Analyze multiple chunks in batches."""
+        verdicts = await self.classify_chunks(chunks, progress, current_progress, progress_step)
+        return self._tally(verdicts)
+
+    async def analyze_script_detailed(self, script: str, progress: Optional[gr.Progress] = None) -> dict:
+        """Analyze the entire script, returning the flagged triggers and a per-scene timeline."""
         if not self.model or not self.tokenizer:
             await self.load_model(progress)
         
-        chunks = self._chunk_text(script)
-        identified_triggers = await self.analyze_chunks_batch(
+        # Segmenting and tokenizing a full script takes long enough to stall other requests
+        if progress is not None:
+            progress(0.5, "Splitting the script into chunks...")
+        loop = asyncio.get_running_loop()
+        scenes = await loop.run_in_executor(None, find_scenes, script)
+        chunks = await loop.run_in_executor(None, lambda: list(self._chunk_text(script, scenes)))
+        verdicts = await self.classify_chunks(
             chunks,
             progress,
             current_progress=0.5,
-            progress_step=0.4 / (len(chunks) * len(self.trigger_categories))
+            progress_step=0.4 / (max(1, len(chunks)) * len(self.trigger_categories))
         )
+        identified_triggers = self._tally(verdicts)
         
-        if progress:
+        if progress is not None:
             progress(0.95, "Finalizing results...")
 
         final_triggers = []
-        chunk_threshold = max(1, len(chunks) * 0.1)
+        chunk_threshold = self._chunk_threshold(len(chunks))
         
         for mapped_name, count in identified_triggers.items():
             if count >= chunk_threshold:
                 final_triggers.append(mapped_name)
 
-        return final_triggers if final_triggers else ["None"]
+        return {
+            "triggers": final_triggers if final_triggers else ["None"],
+            "timeline": self._scene_timeline(scenes, chunks, verdicts) if len(scenes) > 1 else [],
+            "checks": len(chunks) * len(self.trigger_categories),
+            "unlabeled_checks": self.unlabeled_checks
+        }
+
+    async def analyze_script(self, script: str, progress: Optional[gr.Progress] = None) -> List[str]:
+        """Analyze the entire script."""
+        analysis = await self.analyze_script_detailed(script, progress)
+        return analysis["triggers"]
 
 async def analyze_content(
     script: str,
-    progress: Optional[gr.Progress] = None
+    progress: Optional[gr.Progress] = None,
+    detect_only: bool = False,
+    on_category: Optional[Callable[[str, bool], None]] = None
 ) -> Dict[str, Union[List[str], str]]:
-    """Main analysis function for the Gradio interface."""
+    """Main analysis function for the Gradio interface.
+
+    With `detect_only`, categories stop being checked once it is certain whether
+    they are reported; the scene timeline then only covers the chunks checked.
+    `on_category` receives each category's outcome as soon as it is final.
+    """
     logger.info("Starting content analysis")
     
     analyzer = ContentAnalyzer()
+    analyzer.detect_only = detect_only
+    analyzer.on_category = on_category
     
     try:
         # Fix: Use the analyzer instance's method instead of undefined function
-        triggers = await analyzer.analyze_script(script, progress)
+        analysis = await analyzer.analyze_script_detailed(script, progress)
+        triggers = analysis["triggers"]
+        unlabeled = analysis["unlabeled_checks"]
+        if unlabeled and unlabeled == analysis["checks"]:
+            raise RuntimeError(f"None of the {unlabeled} chunk-category checks got a verdict")
         
-        if progress:
+        if progress is not None:
             progress(1.0, "Analysis complete!")
 
+        if unlabeled:
+            # A missing verdict could have been a detection, so neither outcome is certain
+            confidence = f"Partial - {unlabeled}/{analysis['checks']} checks unlabeled"
+        elif triggers != ["None"]:
+            confidence = "High - Content detected"
+        else:
+            confidence = "High - No concerning content detected"
         result = {
             "detected_triggers": triggers,
-            "confidence": "High - Content detected" if triggers != ["None"] else "High - No concerning content detected",
-            "model": "LGAI-EXAONE/EXAONE-Deep-2.4B",
-            "analysis_timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            "confidence": confidence,
+            "unlabeled_checks": unlabeled,
+            "model": MODEL_ID,
+            "analysis_timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "scene_timeline": analysis["timeline"]
         }
 
         logger.info(f"Analysis complete: {result}")
@@ -235,7 +1131,7 @@ async def analyze_content(
         return {
             "detected_triggers": ["Error occurred during analysis"],
             "confidence": "Error", 
-            "model": "LGAI-EXAONE/EXAONE-Deep-2.4B",
+            "model": MODEL_ID,
             "analysis_timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
             "error": str(e)
         }
@@ -0,0 +1,170 @@
+import os
+import time
+import logging
+import argparse
+from typing import Dict, List
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+# "fp32", "bf16" or "int8" (dynamic int8 quantization of the Linear layers)
+CPU_BACKEND = os.environ.get("TREAT_CPU_BACKEND", "fp32")
+TORCH_COMPILE = os.environ.get("TREAT_TORCH_COMPILE", "") == "1"
+NUM_THREADS = int(os.environ.get("TREAT_NUM_THREADS", "0"))  # 0: one per core available to this process
+
+CPU_BACKENDS = ("fp32", "bf16", "int8")
+
+def available_cores() -> int:
+    """Cores this process may run on, honoring CPU affinity and cgroup quotas where visible."""
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cores = os.cpu_count() or 1
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as cpu_max:
+            quota, period = cpu_max.read().split()
+        if quota != "max":
+            cores = min(cores, max(1, int(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return cores
+
+def configure_threads(count: int = NUM_THREADS) -> int:
+    """Size torch's intra-op pool; oversubscribing cores slows every matmul down."""
+    count = count or available_cores()
+    torch.set_num_threads(count)
+    return count
+
+def supports_bf16() -> bool:
+    """Whether the CPU has native bfloat16 matmuls; elsewhere bf16 is emulated and slower than fp32."""
+    try:
+        with open("/proc/cpuinfo") as cpuinfo:
+            flags = cpuinfo.read()
+    except OSError:
+        return False
+    return "avx512_bf16" in flags or "amx_bf16" in flags
+
+def resolve_backend(backend: str) -> str:
+    if backend not in CPU_BACKENDS:
+        raise ValueError(f"Unknown CPU backend {backend!r}, expected one of {', '.join(CPU_BACKENDS)}")
+    if backend == "bf16" and not supports_bf16():
+        logger.warning("CPU has no native bfloat16 support, falling back to fp32")
+        return "fp32"
+    return backend
+
+def load_dtype(backend: str) -> torch.dtype:
+    """Dtype to load the weights in for a CPU backend (int8 quantizes from fp32)."""
+    return torch.bfloat16 if backend == "bf16" else torch.float32
+
+def optimize_for_cpu(model, backend: str, compile: bool = False):
+    """Apply a CPU backend to a model loaded with `load_dtype(backend)`."""
+    if backend == "int8":
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    if compile:
+        # Prompt lengths vary per batch, so avoid recompiling for every new shape
+        model.forward = torch.compile(model.forward, dynamic=True)
+    return model
+
+def weight_bytes(model) -> int:
+    """Memory held by a model's weights, counting quantized Linear layers at their packed size."""
+    total = 0
+    for module in model.modules():
+        if hasattr(module, "_packed_params"):
+            weight, bias = module._weight_bias()
+            tensors = [weight] + ([bias] if bias is not None else [])
+        else:
+            tensors = list(module.parameters(recurse=False)) + list(module.buffers(recurse=False))
+        total += sum(tensor.numel() * tensor.element_size() for tensor in tensors)
+    return total
+
+def compare_backends(
+    model_id: str,
+    backends: List[str],
+    texts: List[str],
+    compile: bool = False
+) -> Dict[str, dict]:
+    """Score `texts` for every category with each backend and compare against fp32.
+
+    Reports per backend the verdict agreement with fp32, the mean absolute
+    difference of the verdict probabilities, seconds per prompt and the size of
+    the weights in memory.
+    """
+    from transformers import AutoTokenizer, AutoModelForCausalLM
+    from model.analyzer import ContentAnalyzer
+    from model.chunking import Chunk
+
+    configure_threads()
+    tokenizer = AutoTokenizer.from_pretrained(model_id, use_fast=True, trust_remote_code=True)
+    tokenizer.padding_side = "left"
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+
+    analyzer = ContentAnalyzer()
+    analyzer.tokenizer = tokenizer
+    prompts = [
+        analyzer._prompt_ids(
+            Chunk(0, text, tokenizer.encode(text, add_special_tokens=False), 0, len(text)),
+            "per_category",
+            category
+        )
+        for text in texts
+        for category in analyzer.trigger_categories
+    ]
+
+    results = {}
+    reference = None
+    for backend in ["fp32"] + [name for name in backends if name != "fp32"]:
+        resolved = resolve_backend(backend)
+        model = AutoModelForCausalLM.from_pretrained(
+            model_id, torch_dtype=load_dtype(resolved), trust_remote_code=True
+        ).eval()
+        model = optimize_for_cpu(model, resolved, compile)
+        analyzer.model = model
+
+        analyzer._score_prompts(prompts[:1])  # warm-up, also triggers compilation
+        started = time.perf_counter()
+        scored = [analyzer._score_prompts([prompt])[0] for prompt in prompts]
+        seconds = (time.perf_counter() - started) / len(prompts)
+
+        weights = weight_bytes(model)
+        if reference is None:
+            reference = scored
+        results[backend] = {
+            "resolved": resolved,
+            "agreement": sum(a[0] == b[0] for a, b in zip(scored, reference)) / len(scored),
+            "mean_probability_delta": sum(abs(a[1] - b[1]) for a, b in zip(scored, reference)) / len(scored),
+            "seconds_per_prompt": seconds,
+            "weight_bytes": weights
+        }
+        del model
+    return results
+
+if __name__ == "__main__":
+    from model.registry import MODEL_ID
+
+    parser = argparse.ArgumentParser(description="Compare CPU backends against the fp32 baseline")
+    parser.add_argument("--model", default=MODEL_ID)
+    parser.add_argument("--backends", default="bf16,int8", help="comma-separated, from: " + ", ".join(CPU_BACKENDS))
+    parser.add_argument("--compile", action="store_true", help="also torch.compile each backend")
+    parser.add_argument("--texts", help="file with one sample text per paragraph (blank-line separated)")
+    args = parser.parse_args()
+
+    if args.texts:
+        with open(args.texts) as handle:
+            samples = [text.strip() for text in handle.read().split("\n\n") if text.strip()]
+    else:
+        samples = [
+            "He pulls the knife and stabs the guard twice. Blood pools on the floor.",
+            "They share a bottle of whiskey on the porch and laugh until sunrise.",
+            "She sits alone in the dark, staring at the pills on the nightstand.",
+            "The kids build a sandcastle while their parents read on the beach."
+        ]
+
+    for backend, report in compare_backends(args.model, args.backends.split(","), samples, args.compile).items():
+        print(
+            f"{backend:>5} ({report['resolved']}): agreement {report['agreement']:.1%}, "
+            f"mean |dp| {report['mean_probability_delta']:.3f}, "
+            f"{report['seconds_per_prompt'] * 1000:.1f} ms/prompt, "
+            f"{report['weight_bytes'] / 2**20:.0f} MiB weights"
+        )
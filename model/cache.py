@@ -0,0 +1,146 @@
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional
+
+from model.forking import reset_after_fork
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = os.environ.get("TREAT_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "treat"))
+CACHE_MAX_ENTRIES = int(os.environ.get("TREAT_CACHE_MAX_ENTRIES", "100000"))
+
+def normalize_text(text: str) -> str:
+    """Collapse whitespace so reflowed copies of the same text share a cache entry."""
+    return " ".join(text.split())
+
+def cache_key(text: str, *parts: str) -> str:
+    """Content address for a verdict: normalized text plus everything that can change the answer."""
+    digest = hashlib.sha256(normalize_text(text).encode("utf-8"))
+    for part in parts:
+        digest.update(b"\0")
+        digest.update(part.encode("utf-8"))
+    return digest.hexdigest()
+
+class ResultCache:
+    """Verdict cache with a bounded in-memory LRU in front of a SQLite store.
+
+    Pass `path=None` for a memory-only cache. Safe to share between threads.
+    """
+
+    def __init__(self, path: Optional[str] = None, max_entries: int = CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS verdicts (key TEXT PRIMARY KEY, verdict TEXT NOT NULL, created REAL NOT NULL)"
+            )
+            self._db.commit()
+
+    def _remember(self, key: str, verdict: str) -> None:
+        self._entries[key] = verdict
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, str]:
+        """Look up several keys at once; missing keys are left out of the result."""
+        found = {}
+        with self._lock:
+            missing = []
+            for key in keys:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    found[key] = self._entries[key]
+                    self.memory_hits += 1
+                else:
+                    missing.append(key)
+
+            if self._db is not None:
+                # Stay well below SQLite's bound-parameter limit
+                for i in range(0, len(missing), 500):
+                    batch = missing[i:i + 500]
+                    rows = self._db.execute(
+                        f"SELECT key, verdict FROM verdicts WHERE key IN ({','.join('?' * len(batch))})",
+                        batch
+                    ).fetchall()
+                    for key, verdict in rows:
+                        found[key] = verdict
+                        self._remember(key, verdict)
+                    self.disk_hits += len(rows)
+
+            self.misses += len(missing) - sum(1 for key in missing if key in found)
+        return found
+
+    def put_many(self, items: Dict[str, str]) -> None:
+        """Store verdicts in both tiers."""
+        if not items:
+            return
+        with self._lock:
+            for key, verdict in items.items():
+                self._remember(key, verdict)
+            if self._db is not None:
+                now = time.time()
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO verdicts (key, verdict, created) VALUES (?, ?, ?)",
+                    [(key, verdict, now) for key, verdict in items.items()]
+                )
+                self._db.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        return self.get_many([key]).get(key)
+
+    def put(self, key: str, verdict: str) -> None:
+        self.put_many({key: verdict})
+
+    def clear(self) -> None:
+        """Drop every entry from both tiers."""
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM verdicts")
+                self._db.commit()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "memory_entries": len(self._entries),
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses
+        }
+
+_result_cache: Optional[ResultCache] = None
+_result_cache_lock = threading.Lock()
+
+@reset_after_fork
+def _forget_result_cache() -> None:
+    """A forked child opens its own SQLite connection instead of sharing the parent's."""
+    global _result_cache, _result_cache_lock
+    _result_cache = None
+    _result_cache_lock = threading.Lock()
+
+def get_result_cache() -> ResultCache:
+    """Process-wide cache, persisted under TREAT_CACHE_DIR (set it to an empty string for memory only)."""
+    global _result_cache
+    with _result_cache_lock:
+        if _result_cache is None:
+            path = os.path.join(CACHE_DIR, "results.sqlite3") if CACHE_DIR else None
+            try:
+                _result_cache = ResultCache(path)
+            except (OSError, sqlite3.Error) as e:
+                logger.error(f"Could not open result cache at {path}, using memory only: {str(e)}")
+                _result_cache = ResultCache(None)
+        return _result_cache
@@ -0,0 +1,139 @@
+import re
+import bisect
+import logging
+from dataclasses import dataclass
+from typing import Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_MASK64 = (1 << 64) - 1
+
+@dataclass
+class Chunk:
+    """A slice of a script together with the token ids it was cut from."""
+    index: int
+    text: str
+    token_ids: List[int]
+    start: int  # character offsets into the source text
+    end: int
+    scenes: range = range(0)  # indices of the screenplay scenes the chunk covers, if any
+
+    def __len__(self) -> int:
+        return len(self.token_ids)
+
+def encode_with_offsets(text: str, tokenizer) -> Tuple[List[int], List[Tuple[int, int]]]:
+    """Tokenize a whole script once, returning token ids and their character offsets."""
+    # The whole script is longer than the model limit on purpose; silence that warning
+    encoding = tokenizer(text, add_special_tokens=False, return_offsets_mapping=True, verbose=False)
+    return encoding["input_ids"], encoding["offset_mapping"]
+
+def token_positions(offsets: List[Tuple[int, int]], char_positions: List[int]) -> List[int]:
+    """Index of the first token starting at or after each character position."""
+    token_starts = [start for start, _ in offsets]
+    return [bisect.bisect_left(token_starts, position) for position in char_positions]
+
+def _gear(token_id: int) -> int:
+    """Fixed pseudo-random 64-bit value per token id (splitmix64)."""
+    z = (token_id + 0x9E3779B97F4A7C15) & _MASK64
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & _MASK64
+    return z ^ (z >> 31)
+
+def window_chunks(
+    text: str,
+    token_ids: List[int],
+    offsets: List[Tuple[int, int]],
+    first: int,
+    last: int,
+    max_tokens: int,
+    overlap_tokens: int,
+    index: int = 0,
+    scenes: range = range(0)
+) -> Iterator[Chunk]:
+    """Yield overlapping windows over the tokens in [first, last), numbering chunks from `index`."""
+    if max_tokens <= overlap_tokens:
+        raise ValueError(f"max_tokens ({max_tokens}) must exceed overlap_tokens ({overlap_tokens})")
+
+    step = max_tokens - overlap_tokens
+    for window_start in range(first, last, step):
+        window_end = min(window_start + max_tokens, last)
+        start, end = offsets[window_start][0], offsets[window_end - 1][1]
+        yield Chunk(index, text[start:end], token_ids[window_start:window_end], start, end, scenes)
+        index += 1
+        if window_end == last:
+            break
+
+def pack_segments(
+    text: str,
+    token_ids: List[int],
+    offsets: List[Tuple[int, int]],
+    starts: List[int],
+    max_tokens: int,
+    overlap_tokens: int,
+    labels: Optional[List[int]] = None
+) -> Iterator[Chunk]:
+    """Pack consecutive segments (scenes, lines) into chunks with content-defined boundaries.
+
+    `starts` are the first token of each segment. A gear rolling hash runs over the
+    tokens; when it hits, a cut becomes due and is taken at the next segment start
+    once the chunk holds at least a quarter of the budget. Because the hash only
+    sees the last few dozen tokens, an edit moves at most the boundaries next to
+    it and a revised script produces mostly the same chunks as before, which keeps
+    their cached verdicts valid. A chunk is also closed when the next segment
+    would overflow `max_tokens`; a single segment longer than that is cut into
+    overlapping windows. `labels` gives each segment's scene index.
+    """
+    segments = [
+        (first, last, labels[i] if labels else None)
+        for i, (first, last) in enumerate(zip(starts, starts[1:] + [len(token_ids)]))
+        if last > first
+    ]
+    if not segments:
+        return
+
+    min_tokens = max_tokens // 4
+    mask = (1 << max(1, (max_tokens // 2).bit_length() - 1)) - 1
+    index = 0
+
+    def emit(first_segment: int, last_segment: int) -> Iterator[Chunk]:
+        first, last = segments[first_segment][0], segments[last_segment][1]
+        covered = range(0)
+        if labels:
+            covered = range(segments[first_segment][2], segments[last_segment][2] + 1)
+        if last - first <= max_tokens:
+            start, end = offsets[first][0], offsets[last - 1][1]
+            yield Chunk(index, text[start:end], token_ids[first:last], start, end, covered)
+        else:
+            yield from window_chunks(text, token_ids, offsets, first, last, max_tokens, overlap_tokens, index, covered)
+
+    rolling = 0
+    due = False
+    chunk_first = 0
+    for position, (first, last, _) in enumerate(segments):
+        if position > chunk_first:
+            size = first - segments[chunk_first][0]
+            if (due and size >= min_tokens) or last - segments[chunk_first][0] > max_tokens:
+                for chunk in emit(chunk_first, position - 1):
+                    yield chunk
+                    index = chunk.index + 1
+                chunk_first = position
+                due = False
+        for token_id in token_ids[first:last]:
+            rolling = ((rolling << 1) + _gear(token_id)) & _MASK64
+            if rolling & mask == 0:
+                due = True
+
+    yield from emit(chunk_first, len(segments) - 1)
+
+def iter_token_chunks(text: str, tokenizer, max_tokens: int, overlap_tokens: int = 32) -> Iterator[Chunk]:
+    """Yield line-aligned chunks of at most `max_tokens` tokens.
+
+    The text is tokenized once; each chunk carries its own slice of the token ids
+    so prompts can be assembled without tokenizing the chunk again, and its text
+    is cut from the source with the tokenizer's character offsets. Lines longer
+    than the budget are split into windows overlapping by `overlap_tokens`.
+    """
+    token_ids, offsets = encode_with_offsets(text, tokenizer)
+    line_starts = [0] + [match.end() for match in re.finditer(r"\n+", text)]
+    starts = sorted(set(token_positions(offsets, line_starts)))
+    yield from pack_segments(text, token_ids, offsets, starts, max_tokens, overlap_tokens)
@@ -0,0 +1,336 @@
+import os
+import time
+import socket
+import asyncio
+import logging
+import argparse
+import threading
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+import requests
+
+from model.chunking import Chunk
+
+logger = logging.getLogger(__name__)
+
+# Queue chunk-category jobs for remote workers instead of labeling them in this process
+COORDINATOR = os.environ.get("TREAT_COORDINATOR", "") == "1"
+LEASE_SECONDS = float(os.environ.get("TREAT_LEASE_SECONDS", "60"))
+# Shared secret workers send in the X-Treat-Token header; required, the job endpoints stay off without it
+COORDINATOR_TOKEN = os.environ.get("TREAT_COORDINATOR_TOKEN", "")
+
+VERDICTS = ("YES", "NO", "MAYBE", None)
+
+def chunk_to_json(chunk: Chunk) -> dict:
+    return {
+        "index": chunk.index,
+        "text": chunk.text,
+        "token_ids": chunk.token_ids,
+        "start": chunk.start,
+        "end": chunk.end,
+        "scenes": [chunk.scenes.start, chunk.scenes.stop]
+    }
+
+def chunk_from_json(data: dict) -> Chunk:
+    return Chunk(data["index"], data["text"], data["token_ids"], data["start"], data["end"], range(*data["scenes"]))
+
+@dataclass
+class _Job:
+    job_id: int
+    job: dict
+    future: Future
+    worker_id: Optional[str] = None
+    lease_expires: float = 0.0
+    attempts: int = 0
+    queued: float = field(default_factory=time.monotonic)
+
+class Coordinator:
+    """Hands chunk-category jobs to remote workers that pull them over HTTP.
+
+    Has the same `submit`/`run` interface as the local `WorkerPool`. A leased
+    job belongs to its worker until the lease runs out; heartbeats extend it.
+    Jobs whose lease expired go back to the front of the queue for the next
+    worker. The first result to arrive for a job wins.
+    """
+
+    def __init__(self, lease_seconds: float = LEASE_SECONDS, max_attempts: int = 5):
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.completed = 0
+        self.failed = 0
+        self.requeued = 0
+        self._queue: "deque[_Job]" = deque()
+        self._leased: Dict[int, _Job] = {}
+        self._workers: Dict[str, float] = {}
+        self._next_job = 0
+        self._lock = threading.Lock()
+
+    def submit(self, job: dict) -> Future:
+        """Queue a job of `chunks`, `categories` and analyzer `settings`; resolves to its verdicts."""
+        future = Future()
+        with self._lock:
+            self._queue.append(_Job(self._next_job, job, future))
+            self._next_job += 1
+        return future
+
+    async def run(self, job: dict) -> Dict[str, List[Optional[str]]]:
+        return await asyncio.wrap_future(self.submit(job))
+
+    def _requeue_expired(self, now: float) -> None:
+        for job_id, entry in list(self._leased.items()):
+            if entry.lease_expires > now:
+                continue
+            del self._leased[job_id]
+            logger.warning(f"Lease of job {job_id} held by {entry.worker_id} expired, re-queuing")
+            if entry.attempts >= self.max_attempts:
+                self.failed += 1
+                entry.future.set_exception(RuntimeError(f"Job {job_id} expired {entry.attempts} times"))
+                continue
+            entry.worker_id = None
+            self.requeued += 1
+            self._queue.appendleft(entry)
+
+    def lease(self, worker_id: str, max_jobs: int = 1) -> List[dict]:
+        """Give a worker up to `max_jobs` jobs, serialized for transport."""
+        now = time.monotonic()
+        leased = []
+        with self._lock:
+            self._workers[worker_id] = now
+            self._requeue_expired(now)
+            while self._queue and len(leased) < max_jobs:
+                entry = self._queue.popleft()
+                # Jobs whose submitter stopped waiting (e.g. a settled category) are dropped
+                if not (entry.future.running() or entry.future.set_running_or_notify_cancel()):
+                    continue
+                entry.worker_id = worker_id
+                entry.lease_expires = now + self.lease_seconds
+                entry.attempts += 1
+                self._leased[entry.job_id] = entry
+                leased.append({
+                    "job_id": entry.job_id,
+                    "lease_seconds": self.lease_seconds,
+                    "chunks": [chunk_to_json(chunk) for chunk in entry.job["chunks"]],
+                    "categories": entry.job["categories"],
+                    "settings": entry.job["settings"]
+                })
+        return leased
+
+    def heartbeat(self, worker_id: str, job_ids: List[int]) -> Dict[str, List[int]]:
+        """Extend the worker's leases; jobs it no longer holds are reported as lost."""
+        now = time.monotonic()
+        renewed, lost = [], []
+        with self._lock:
+            self._workers[worker_id] = now
+            self._requeue_expired(now)
+            for job_id in job_ids:
+                entry = self._leased.get(job_id)
+                if entry is not None and entry.worker_id == worker_id:
+                    entry.lease_expires = now + self.lease_seconds
+                    renewed.append(job_id)
+                else:
+                    lost.append(job_id)
+        return {"renewed": renewed, "lost": lost}
+
+    def _find(self, job_id: int) -> Optional[_Job]:
+        if job_id in self._leased:
+            return self._leased[job_id]
+        # A result for a job that was re-queued after its lease expired is still good
+        return next((queued for queued in self._queue if queued.job_id == job_id), None)
+
+    def _take(self, job_id: int) -> Optional[_Job]:
+        entry = self._find(job_id)
+        if entry is not None:
+            if self._leased.pop(job_id, None) is None:
+                self._queue.remove(entry)
+        return entry
+
+    @staticmethod
+    def _check_verdicts(job: dict, verdicts: Dict[str, List[Optional[str]]]) -> None:
+        """Raise ValueError unless there is one YES/NO/MAYBE/None per chunk for exactly the job's categories."""
+        if not isinstance(verdicts, dict) or set(verdicts) != set(job["categories"]):
+            raise ValueError(f"Verdicts must cover exactly the categories {sorted(job['categories'])}")
+        for category, labels in verdicts.items():
+            if not isinstance(labels, list) or len(labels) != len(job["chunks"]):
+                raise ValueError(f"{category} needs one verdict for each of the {len(job['chunks'])} chunks")
+            invalid = [label for label in labels if label not in VERDICTS]
+            if invalid:
+                raise ValueError(f"Invalid verdicts for {category}: {invalid[:3]}")
+
+    def complete(self, worker_id: str, job_id: int, verdicts: Dict[str, List[Optional[str]]]) -> bool:
+        """Record a job's verdicts; False when the job is unknown or already finished.
+
+        Raises ValueError for verdicts that do not fit the job, which is left to
+        its lease.
+        """
+        with self._lock:
+            self._workers[worker_id] = time.monotonic()
+            entry = self._find(job_id)
+            if entry is None:
+                return False
+            self._check_verdicts(entry.job, verdicts)
+            self._take(job_id)
+            self.completed += 1
+        entry.future.set_result(verdicts)
+        return True
+
+    def fail(self, worker_id: str, job_id: int, error: str) -> bool:
+        """A worker could not run a job; retry it elsewhere until `max_attempts`."""
+        with self._lock:
+            entry = self._take(job_id)
+            if entry is None:
+                return False
+            logger.warning(f"Worker {worker_id} failed job {job_id}: {error}")
+            if entry.attempts < self.max_attempts:
+                entry.worker_id = None
+                self.requeued += 1
+                self._queue.appendleft(entry)
+                return True
+            self.failed += 1
+        entry.future.set_exception(RuntimeError(error))
+        return True
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            self._requeue_expired(now)
+            return {
+                "queued": len(self._queue),
+                "leased": len(self._leased),
+                "completed": self.completed,
+                "failed": self.failed,
+                "requeued": self.requeued,
+                "workers": {worker: round(now - seen, 1) for worker, seen in self._workers.items()}
+            }
+
+_coordinator: Optional[Coordinator] = None
+_coordinator_lock = threading.Lock()
+_missing_token_logged = False
+_serving = False  # set in remote workers, which must label jobs themselves
+
+def get_coordinator() -> Optional[Coordinator]:
+    """Process-wide coordinator when TREAT_COORDINATOR=1, else None (always None in a remote worker).
+
+    Also None without TREAT_COORDINATOR_TOKEN: workers could not lease the
+    jobs, and anyone could post verdicts into the shared caches.
+    """
+    global _coordinator, _missing_token_logged
+    if not COORDINATOR or _serving:
+        return None
+    with _coordinator_lock:
+        if not COORDINATOR_TOKEN:
+            if not _missing_token_logged:
+                logger.warning("TREAT_COORDINATOR is set but TREAT_COORDINATOR_TOKEN is not; analyzing locally")
+                _missing_token_logged = True
+            return None
+        if _coordinator is None:
+            _coordinator = Coordinator()
+        return _coordinator
+
+class RemoteWorker:
+    """Pulls jobs from a coordinator, labels them with the local model and posts the verdicts back."""
+
+    def __init__(self, coordinator_url: str, worker_id: Optional[str] = None, poll_interval: float = 1.0):
+        self.url = coordinator_url.rstrip("/")
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.poll_interval = poll_interval
+        self.session = requests.Session()
+        if COORDINATOR_TOKEN:
+            self.session.headers["X-Treat-Token"] = COORDINATOR_TOKEN
+        self._held: List[int] = []
+        self._lease_seconds = LEASE_SECONDS
+        self._held_lock = threading.Lock()
+
+    def _post(self, path: str, payload: dict) -> dict:
+        response = self.session.post(f"{self.url}{path}", json=payload, timeout=30)
+        response.raise_for_status()
+        return response.json()
+
+    def _heartbeat(self, stop: threading.Event) -> None:
+        """Renew held leases three times per lease period, as set by the coordinator with each job."""
+        last = 0.0
+        while not stop.wait(0.5):
+            with self._held_lock:
+                held = list(self._held)
+                interval = self._lease_seconds / 3
+            if not held or time.monotonic() - last < interval:
+                continue
+            last = time.monotonic()
+            try:
+                lost = self._post("/api/jobs/heartbeat", {"worker_id": self.worker_id, "job_ids": held})["lost"]
+                if lost:
+                    logger.warning(f"Lost the leases of jobs {lost}")
+            except requests.RequestException as e:
+                logger.warning(f"Heartbeat failed: {str(e)}")
+
+    async def serve(self, max_jobs: Optional[int] = None) -> None:
+        """Work until stopped, or until `max_jobs` jobs were handled."""
+        # Set on the imported module: run as `python -m model.distributed`, this one is __main__
+        import model.distributed
+        model.distributed._serving = True
+        from model.analyzer import ContentAnalyzer
+
+        analyzer = ContentAnalyzer()
+        # The coordinator already consulted the cache, the near-duplicate index and the pre-filter
+        analyzer.use_cache = False
+        analyzer.near_dup_threshold = None
+        analyzer.prefilter = None
+        await analyzer.load_model()
+
+        stop = threading.Event()
+        beat = threading.Thread(target=self._heartbeat, args=(stop,), daemon=True)
+        beat.start()
+        handled = 0
+        try:
+            while max_jobs is None or handled < max_jobs:
+                try:
+                    jobs = await asyncio.to_thread(self._post, "/api/jobs/lease", {"worker_id": self.worker_id, "max_jobs": 1})
+                except requests.RequestException as e:
+                    logger.warning(f"Could not reach coordinator at {self.url}: {str(e)}")
+                    await asyncio.sleep(self.poll_interval)
+                    continue
+                if not jobs["jobs"]:
+                    await asyncio.sleep(self.poll_interval)
+                    continue
+
+                for job in jobs["jobs"]:
+                    with self._held_lock:
+                        self._held.append(job["job_id"])
+                        self._lease_seconds = job["lease_seconds"]
+                    try:
+                        for name, value in job["settings"].items():
+                            setattr(analyzer, name, value)
+                        analyzer.trigger_categories = job["categories"]
+                        chunks = [chunk_from_json(data) for data in job["chunks"]]
+                        verdicts = await analyzer.classify_chunks(chunks)
+                        await asyncio.to_thread(
+                            self._post, f"/api/jobs/{job['job_id']}/complete",
+                            {"worker_id": self.worker_id, "verdicts": verdicts}
+                        )
+                    except Exception as e:
+                        logger.error(f"Job {job['job_id']} failed: {str(e)}")
+                        try:
+                            await asyncio.to_thread(
+                                self._post, f"/api/jobs/{job['job_id']}/fail",
+                                {"worker_id": self.worker_id, "error": str(e)}
+                            )
+                        except requests.RequestException:
+                            pass  # the lease runs out and the job is re-queued
+                    finally:
+                        with self._held_lock:
+                            self._held.remove(job["job_id"])
+                    handled += 1
+        finally:
+            stop.set()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run an analysis worker that pulls jobs from a coordinator")
+    parser.add_argument("--coordinator", default="http://localhost:8000", help="base URL of the coordinator's API")
+    parser.add_argument("--worker-id", help="defaults to <hostname>-<pid>")
+    parser.add_argument("--poll-interval", type=float, default=1.0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(RemoteWorker(args.coordinator, args.worker_id, args.poll_interval).serve())
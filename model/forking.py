@@ -0,0 +1,13 @@
+import os
+from typing import Callable
+
+def reset_after_fork(reset: Callable[[], None]) -> Callable[[], None]:
+    """Run `reset` in every forked child, where the platform supports it; usable as a decorator.
+
+    Worker processes are forked from a parent with live threads, so locks may be
+    held, threads are gone and SQLite connections must not be shared. Each
+    module resets its own process-wide state through this.
+    """
+    if hasattr(os, "register_at_fork"):
+        os.register_at_fork(after_in_child=reset)
+    return reset
@@ -0,0 +1,114 @@
+import re
+import time
+import threading
+from typing import Callable, List
+
+import torch
+from transformers import LogitsProcessor, StoppingCriteria
+
+THOUGHT_OPEN = "<thought>"
+THOUGHT_CLOSE = "</thought>"
+
+VERDICT_PATTERN = re.compile(r"\b(YES|NO|MAYBE)\b")
+
+def final_answer(response: str) -> str:
+    """The part of an EXAONE-Deep response after its reasoning section.
+
+    A response whose thought never closed has no final answer and yields "".
+    """
+    if THOUGHT_CLOSE in response:
+        return response.rsplit(THOUGHT_CLOSE, 1)[1]
+    if THOUGHT_OPEN in response:
+        return ""
+    return response
+
+def _find(sequence: List[int], pattern: List[int]) -> int:
+    """Index just past the first occurrence of `pattern` in `sequence`, or -1."""
+    width = len(pattern)
+    for start in range(len(sequence) - width + 1):
+        if sequence[start:start + width] == pattern:
+            return start + width
+    return -1
+
+class DeadlineStoppingCriteria(StoppingCriteria):
+    """Stop decoding once a wall-clock deadline passes or the caller cancels."""
+
+    def __init__(self, deadline: float, cancelled: threading.Event):
+        self.deadline = deadline
+        self.cancelled = cancelled
+        self.expired = False
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        self.expired = self.expired or time.monotonic() >= self.deadline
+        done = self.expired or self.cancelled.is_set()
+        return torch.full((input_ids.shape[0],), done, dtype=torch.bool, device=input_ids.device)
+
+class AnswerStoppingCriteria(StoppingCriteria):
+    """Finish a row as soon as its final answer is complete.
+
+    Rows whose prompt opened a thought (`thinking`), or that open one themselves,
+    only look for the answer after the closing tag; other rows look from their
+    first generated token. `is_complete` decides whether the answer text so far
+    is enough, e.g. contains a YES/NO/MAYBE verdict.
+    """
+
+    def __init__(
+        self,
+        tokenizer,
+        prompt_length: int,
+        thinking: bool,
+        is_complete: Callable[[str], bool]
+    ):
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+        self.thinking = thinking
+        self.is_complete = is_complete
+        self.open_ids = tokenizer.encode(THOUGHT_OPEN, add_special_tokens=False)
+        self.close_ids = tokenizer.encode(THOUGHT_CLOSE, add_special_tokens=False)
+        self._answer_start = {}
+
+    def answer_start(self, row: int, generated: List[int]) -> int:
+        """Offset of the answer in a row's generated tokens, or -1 while it is still thinking."""
+        if row in self._answer_start:
+            return self._answer_start[row]
+        if not self.thinking and len(generated) < len(self.open_ids) and self.open_ids[:len(generated)] == generated:
+            return -1  # may still be spelling out the opening tag
+        thinking = self.thinking or generated[:len(self.open_ids)] == self.open_ids
+        start = _find(generated, self.close_ids) if thinking else 0
+        if start >= 0:
+            self._answer_start[row] = start
+        return start
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        done = []
+        for row, sequence in enumerate(input_ids[:, self.prompt_length:].tolist()):
+            start = self.answer_start(row, sequence)
+            answer = self.tokenizer.decode(sequence[start:], skip_special_tokens=True) if start >= 0 else ""
+            done.append(start >= 0 and self.is_complete(answer))
+        return torch.tensor(done, dtype=torch.bool, device=input_ids.device)
+
+class ThinkingBudgetProcessor(LogitsProcessor):
+    """Force the closing thought tag once a row has spent `budget` tokens reasoning.
+
+    Shares `AnswerStoppingCriteria`'s view of where each row's answer starts, so a
+    row that already closed its thought is left alone.
+    """
+
+    def __init__(self, answers: AnswerStoppingCriteria, budget: int):
+        self.answers = answers
+        self.budget = budget
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        close_ids = self.answers.close_ids
+        generated_length = input_ids.shape[1] - self.answers.prompt_length
+        step = generated_length - self.budget
+        if step < 0 or step >= len(close_ids):
+            return scores
+
+        for row, sequence in enumerate(input_ids[:, self.answers.prompt_length:].tolist()):
+            if self.answers.answer_start(row, sequence) >= 0:
+                continue
+            forced = torch.full_like(scores[row], float("-inf"))
+            forced[close_ids[step]] = 0
+            scores[row] = forced
+        return scores
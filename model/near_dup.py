@@ -0,0 +1,193 @@
+import os
+import json
+import zlib
+import random
+import sqlite3
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from model.cache import CACHE_DIR, CACHE_MAX_ENTRIES, normalize_text
+from model.forking import reset_after_fork
+
+logger = logging.getLogger(__name__)
+
+_PRIME = (1 << 31) - 1  # keeps a * hash + b inside uint64 for 32-bit shingle hashes
+
+class MinHashIndex:
+    """MinHash/LSH index of analyzed chunks and their per-category verdicts.
+
+    Chunks are shingled into word n-grams and summarized by `num_perm` MinHash
+    values, split into `bands` LSH bands. A query only compares signatures that
+    share at least one band bucket, then keeps the best match whose estimated
+    Jaccard similarity reaches the threshold. Entries are namespaced so verdicts
+    from another model or prompt setup are never reused. Only the newest
+    `max_entries` chunks are kept, in memory and on disk. Pass `path=None` for
+    a memory-only index.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        max_entries: int = CACHE_MAX_ENTRIES,
+        num_perm: int = 64,
+        bands: int = 16,
+        shingle_size: int = 5
+    ):
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) must be a multiple of bands ({bands})")
+        self.path = path
+        self.max_entries = max_entries
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        self.lookups = 0
+        self.hits = 0
+
+        rng = random.Random(20240229)  # fixed so persisted signatures stay comparable
+        self._a = np.array([rng.randrange(1, _PRIME) for _ in range(num_perm)], dtype=np.uint64)
+        self._b = np.array([rng.randrange(0, _PRIME) for _ in range(num_perm)], dtype=np.uint64)
+
+        self._signatures: Dict[int, np.ndarray] = {}
+        self._entries: Dict[int, Tuple[str, Dict[str, str]]] = {}
+        self._buckets: Dict[Tuple[int, bytes], List[int]] = {}
+        self._ids: Dict[Tuple[str, bytes], int] = {}  # (namespace, signature bytes) -> entry id
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS minhash "
+                "(id INTEGER PRIMARY KEY, namespace TEXT NOT NULL, signature BLOB NOT NULL, verdicts TEXT NOT NULL)"
+            )
+            self._db.commit()
+            self._load()
+
+    def _load(self) -> None:
+        rows = self._db.execute(
+            "SELECT id, namespace, signature, verdicts FROM minhash ORDER BY id DESC LIMIT ?", (self.max_entries,)
+        ).fetchall()
+        for entry_id, namespace, signature, verdicts in reversed(rows):
+            self._next_id = entry_id + 1
+            if (namespace, signature) not in self._ids:
+                self._insert(entry_id, namespace, np.frombuffer(signature, dtype=np.uint64), json.loads(verdicts))
+        if rows:
+            # Entries past the limit would never be loaded again
+            self._db.execute("DELETE FROM minhash WHERE id < ?", (rows[-1][0],))
+            self._db.commit()
+            logger.info(f"Loaded {len(rows)} near-duplicate index entries from {self.path}")
+
+    def signature(self, text: str) -> np.ndarray:
+        """MinHash signature of the word shingles of `text`."""
+        words = normalize_text(text).lower().split()
+        size = min(self.shingle_size, len(words)) or 1
+        shingles = {" ".join(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+        hashes = np.array([zlib.crc32(shingle.encode("utf-8")) for shingle in shingles], dtype=np.uint64)
+        permuted = (hashes[:, None] * self._a[None, :] + self._b[None, :]) % np.uint64(_PRIME)
+        return permuted.min(axis=0)
+
+    def _band_keys(self, signature: np.ndarray) -> List[Tuple[int, bytes]]:
+        return [
+            (band, signature[band * self.rows:(band + 1) * self.rows].tobytes())
+            for band in range(self.bands)
+        ]
+
+    def _insert(self, entry_id: int, namespace: str, signature: np.ndarray, verdicts: Dict[str, str]) -> None:
+        self._signatures[entry_id] = signature
+        self._entries[entry_id] = (namespace, verdicts)
+        self._ids[(namespace, signature.tobytes())] = entry_id
+        for key in self._band_keys(signature):
+            self._buckets.setdefault(key, []).append(entry_id)
+
+    def _evict(self) -> List[int]:
+        """Drop the oldest entries beyond `max_entries`; returns their ids."""
+        evicted = []
+        while len(self._entries) > self.max_entries:
+            entry_id = next(iter(self._entries))  # ids are inserted in increasing order
+            namespace, _ = self._entries.pop(entry_id)
+            signature = self._signatures.pop(entry_id)
+            del self._ids[(namespace, signature.tobytes())]
+            for key in self._band_keys(signature):
+                bucket = self._buckets[key]
+                bucket.remove(entry_id)
+                if not bucket:
+                    del self._buckets[key]
+            evicted.append(entry_id)
+        return evicted
+
+    def query(self, signature: np.ndarray, namespace: str, threshold: float) -> Optional[Tuple[Dict[str, str], float]]:
+        """Verdicts of the most similar stored chunk at or above `threshold`, with its similarity."""
+        with self._lock:
+            self.lookups += 1
+            candidates = set()
+            for key in self._band_keys(signature):
+                candidates.update(self._buckets.get(key, ()))
+
+            best = None
+            for entry_id in candidates:
+                entry_namespace, verdicts = self._entries[entry_id]
+                if entry_namespace != namespace:
+                    continue
+                similarity = float(np.mean(self._signatures[entry_id] == signature))
+                if similarity >= threshold and (best is None or similarity > best[1]):
+                    best = (verdicts, similarity)
+
+            if best:
+                self.hits += 1
+            return best
+
+    def add(self, signature: np.ndarray, namespace: str, verdicts: Dict[str, str]) -> None:
+        """Index a chunk's verdicts; persisted immediately when the index has a path.
+
+        A signature already indexed in `namespace` is not stored twice.
+        """
+        signature = signature.astype(np.uint64)
+        with self._lock:
+            if (namespace, signature.tobytes()) in self._ids:
+                return
+            entry_id = self._next_id
+            self._next_id += 1
+            self._insert(entry_id, namespace, signature, dict(verdicts))
+            evicted = self._evict()
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT INTO minhash (id, namespace, signature, verdicts) VALUES (?, ?, ?, ?)",
+                    (entry_id, namespace, signature.tobytes(), json.dumps(verdicts))
+                )
+                self._db.executemany("DELETE FROM minhash WHERE id = ?", [(evicted_id,) for evicted_id in evicted])
+                self._db.commit()
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "entries": len(self._entries),
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_rate": self.hits / self.lookups if self.lookups else 0.0
+        }
+
+_near_dup_index: Optional[MinHashIndex] = None
+_near_dup_lock = threading.Lock()
+
+@reset_after_fork
+def _forget_near_dup_index() -> None:
+    global _near_dup_index, _near_dup_lock
+    _near_dup_index = None
+    _near_dup_lock = threading.Lock()
+
+def get_near_dup_index() -> MinHashIndex:
+    """Process-wide index, persisted next to the result cache under TREAT_CACHE_DIR."""
+    global _near_dup_index
+    with _near_dup_lock:
+        if _near_dup_index is None:
+            path = os.path.join(CACHE_DIR, "near_dup.sqlite3") if CACHE_DIR else None
+            try:
+                _near_dup_index = MinHashIndex(path)
+            except (OSError, sqlite3.Error) as e:
+                logger.error(f"Could not open near-duplicate index at {path}, using memory only: {str(e)}")
+                _near_dup_index = MinHashIndex(None)
+        return _near_dup_index
@@ -0,0 +1,312 @@
+import os
+import zlib
+import logging
+import threading
+from collections import deque
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+import torch
+
+from model.forking import reset_after_fork
+
+logger = logging.getLogger(__name__)
+
+# Comma-separated stages to run before the model: "lexicon", "embedding" (empty disables the pre-filter)
+PREFILTER_STAGES = os.environ.get("TREAT_PREFILTER", "")
+PREFILTER_AUDIT_RATE = float(os.environ.get("TREAT_PREFILTER_AUDIT_RATE", "0.05"))
+EMBEDDING_MODEL_ID = os.environ.get("TREAT_PREFILTER_EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+EMBEDDING_THRESHOLD = float(os.environ.get("TREAT_PREFILTER_EMBEDDING_THRESHOLD", "0.25"))
+
+# Terms are matched case-insensitively at the start of a word, so "kill" also covers "killed" and "killer"
+DEFAULT_LEXICONS = {
+    "Violence": [
+        "kill", "murder", "shoot", "shot", "gun", "pistol", "rifle", "knife", "stab", "punch", "kick", "beat",
+        "fight", "attack", "assault", "strangl", "chok", "slap", "hit him", "hit her", "wound", "weapon",
+        "blast", "explo", "bomb", "torture", "war", "battle", "slash", "smash", "hurt", "violen", "threat",
+        "hostage", "bullet", "grenade", "sword", "axe", "brawl", "massacre"
+    ],
+    "Death": [
+        "dead", "death", "die", "dying", "kill", "murder", "corpse", "body", "funeral", "grave", "coffin",
+        "cemetery", "mourn", "buried", "bury", "casket", "widow", "orphan", "suicid", "passed away", "fatal",
+        "lifeless", "morgue", "autopsy", "execut", "ghost", "rest in peace"
+    ],
+    "Substance_Use": [
+        "drunk", "drink", "beer", "wine", "whiskey", "whisky", "vodka", "liquor", "alcohol", "booze", "bar ",
+        "cocaine", "coke", "heroin", "meth", "crack", "weed", "marijuana", "joint", "pill", "overdos", "high",
+        "stoned", "smok", "cigarette", "needle", "inject", "snort", "dealer", "addict", "rehab", "hangover",
+        "shot glass", "bottle", "opioid", "drug"
+    ],
+    "Gore": [
+        "blood", "bleed", "gore", "guts", "entrail", "sever", "decapitat", "dismember", "mutilat", "wound",
+        "flesh", "bone", "skull", "brain", "intestin", "organ", "splatter", "gash", "torn", "rip", "impal",
+        "maggot", "rotting", "corpse", "eyeball", "amputat"
+    ],
+    "Sexual_Content": [
+        "sex", "naked", "nude", "undress", "kiss", "bed", "lover", "make love", "making love", "orgasm",
+        "breast", "thigh", "intimate", "seduc", "aroused", "erotic", "strip", "lingerie", "affair", "moan",
+        "caress", "condom", "porn", "one night"
+    ],
+    "Sexual_Abuse": [
+        "rape", "molest", "abuse", "assault", "grope", "harass", "forced", "non-consensual", "against her will",
+        "against his will", "trafficking", "exploit", "predator", "pedophil", "incest", "coerc", "victim",
+        "unwanted", "drugged"
+    ],
+    "Self_Harm": [
+        "suicid", "kill myself", "kill herself", "kill himself", "end it all", "end my life", "cut myself",
+        "cutting", "wrist", "razor", "overdos", "hang myself", "hanging", "noose", "jump off", "self-harm",
+        "self harm", "pills", "want to die", "don't want to live", "bridge", "ledge", "scar"
+    ],
+    "Mental_Health": [
+        "depress", "anxi", "panic", "therap", "psychiatr", "psycholog", "trauma", "ptsd", "bipolar",
+        "schizophren", "hallucinat", "paranoi", "breakdown", "nightmare", "hopeless", "worthless", "lonely",
+        "crazy", "insane", "asylum", "medication", "obsess", "disorder", "grief", "despair", "sob", "cry",
+        "scream", "shaking", "tremb"
+    ]
+}
+
+class AhoCorasick:
+    """Automaton that finds every occurrence of a set of patterns in one pass over the text."""
+
+    def __init__(self, patterns: List[str]):
+        self.patterns = patterns
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[int]] = [[]]
+        for pattern_id, pattern in enumerate(patterns):
+            node = 0
+            for char in pattern:
+                child = self._goto[node].get(char)
+                if child is None:
+                    child = len(self._goto)
+                    self._goto[node][char] = child
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                node = child
+            self._out[node].append(pattern_id)
+
+        # Breadth-first, so every failure link points at an already finished node
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(char, 0)
+                self._fail[child] = target if target != child else 0
+                self._out[child] = self._out[child] + self._out[self._fail[child]]
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, int]]:
+        """Yield (start, pattern id) for every match, overlapping ones included."""
+        node = 0
+        for position, char in enumerate(text):
+            while node and char not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(char, 0)
+            for pattern_id in self._out[node]:
+                yield position - len(self.patterns[pattern_id]) + 1, pattern_id
+
+class LexiconStage:
+    """Scores a chunk per category by its lexicon hits, using one automaton per category."""
+
+    name = "lexicon"
+
+    def __init__(self, lexicons: Dict[str, List[str]], min_hits: int = 1):
+        self.min_hits = min_hits
+        self._automata = {
+            category: AhoCorasick(sorted({term.lower() for term in terms}))
+            for category, terms in lexicons.items()
+        }
+
+    def scores(self, texts: List[str], categories: List[str]) -> List[Dict[str, float]]:
+        results = []
+        for text in texts:
+            text = text.lower()
+            scores = {}
+            for category in categories:
+                automaton = self._automata.get(category)
+                if automaton is None:
+                    # No lexicon means no way to rule the category out
+                    scores[category] = float("inf")
+                    continue
+                scores[category] = sum(
+                    1 for start, _ in automaton.iter_matches(text)
+                    if start == 0 or not text[start - 1].isalnum()
+                )
+            results.append(scores)
+        return results
+
+    def passes(self, score: float) -> bool:
+        return score >= self.min_hits
+
+class EmbeddingStage:
+    """Scores a chunk per category by cosine similarity to the category's definition.
+
+    Runs a small sentence-embedding model on CPU, loaded on first use.
+    """
+
+    name = "embedding"
+
+    def __init__(
+        self,
+        descriptions: Dict[str, str],
+        model_id: str = EMBEDDING_MODEL_ID,
+        threshold: float = EMBEDDING_THRESHOLD,
+        max_tokens: int = 256
+    ):
+        self.descriptions = descriptions
+        self.model_id = model_id
+        self.threshold = threshold
+        self.max_tokens = max_tokens
+        self._tokenizer = None
+        self._model = None
+        self._prototypes = None
+        self._lock = threading.Lock()
+
+    def _embed(self, texts: List[str]) -> torch.Tensor:
+        inputs = self._tokenizer(texts, padding=True, truncation=True, max_length=self.max_tokens, return_tensors="pt")
+        with torch.no_grad():
+            hidden = self._model(**inputs).last_hidden_state
+        mask = inputs["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+        pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1)
+        return torch.nn.functional.normalize(pooled, dim=-1)
+
+    def _load(self) -> None:
+        with self._lock:
+            if self._model is not None:
+                return
+            from transformers import AutoModel, AutoTokenizer
+
+            self._tokenizer = AutoTokenizer.from_pretrained(self.model_id)
+            self._model = AutoModel.from_pretrained(self.model_id).eval()
+            self._prototypes = dict(zip(self.descriptions, self._embed(list(self.descriptions.values()))))
+            logger.info(f"Loaded pre-filter embedding model {self.model_id}")
+
+    def scores(self, texts: List[str], categories: List[str]) -> List[Dict[str, float]]:
+        self._load()
+        embeddings = self._embed(texts)
+        return [
+            {
+                category: float(embedding @ self._prototypes[category]) if category in self._prototypes else float("inf")
+                for category in categories
+            }
+            for embedding in embeddings
+        ]
+
+    def passes(self, score: float) -> bool:
+        return score >= self.threshold
+
+class PreFilter:
+    """Cheap stages that decide which chunk-category checks are worth a model call.
+
+    A check goes to the model when any stage finds evidence for the category;
+    the rest are answered NO without it. A deterministic `audit_rate` sample of
+    the rejected checks still goes to the model, and what it says about them
+    estimates the filter's recall. Lower stage thresholds (`min_hits`,
+    `threshold`) raise recall at the cost of more model calls.
+    """
+
+    def __init__(self, stages: List[object], audit_rate: float = PREFILTER_AUDIT_RATE):
+        self.stages = stages
+        self.audit_rate = audit_rate
+        self.checked = 0
+        self.rejected = 0
+        self.audited = 0
+        self.audit_positives = 0
+        self.passed_labeled = 0
+        self.passed_positives = 0
+        self._lock = threading.Lock()
+
+    def screen(self, texts: List[str], pending: List[List[str]]) -> List[Tuple[Set[str], Set[str]]]:
+        """Split each text's pending categories into (skipped, audited) ones; the rest need the model.
+
+        Skipped categories had no evidence from any stage; audited ones had none
+        either but fell into the audit sample.
+        """
+        categories = sorted({category for names in pending for category in names})
+        evidence = [set() for _ in texts]
+        for stage in self.stages:
+            for found, scores in zip(evidence, stage.scores(texts, categories)):
+                found.update(category for category, score in scores.items() if stage.passes(score))
+
+        screened = []
+        for text, names, found in zip(texts, pending, evidence):
+            rejected = [category for category in names if category not in found]
+            audited = {category for category in rejected if self._sampled(text, category)}
+            screened.append((set(rejected) - audited, audited))
+            with self._lock:
+                self.checked += len(names)
+                self.rejected += len(rejected)
+        return screened
+
+    def _sampled(self, text: str, category: str) -> bool:
+        """Stable per (text, category), so the same chunk is audited on every run."""
+        bucket = zlib.crc32(f"{category}\0{text}".encode("utf-8")) / 0xFFFFFFFF
+        return bucket < self.audit_rate
+
+    def record(self, verdict: Optional[str], audited: bool) -> None:
+        """Feed back the model's verdict for a check that had evidence or was audited."""
+        if verdict is None:
+            return
+        positive = verdict in ("YES", "MAYBE")
+        with self._lock:
+            if audited:
+                self.audited += 1
+                self.audit_positives += positive
+            else:
+                self.passed_labeled += 1
+                self.passed_positives += positive
+
+    def stats(self) -> Dict[str, float]:
+        """Counters plus the recall estimated from the audit sample (None until something was audited)."""
+        recall = None
+        if self.audited:
+            missed = self.audit_positives / self.audited * self.rejected
+            found = self.passed_positives
+            recall = found / (found + missed) if found + missed else 1.0
+        return {
+            "checked": self.checked,
+            "rejected": self.rejected,
+            "skip_rate": self.rejected / self.checked if self.checked else 0.0,
+            "audited": self.audited,
+            "audit_positives": self.audit_positives,
+            "estimated_recall": recall
+        }
+
+_prefilter: Optional[PreFilter] = None
+_prefilter_lock = threading.Lock()
+
+@reset_after_fork
+def _reset_prefilter_locks() -> None:
+    """Forked workers get unlocked copies even if a thread held a lock at fork time."""
+    global _prefilter_lock
+    _prefilter_lock = threading.Lock()
+    if _prefilter is not None:
+        _prefilter._lock = threading.Lock()
+        for stage in _prefilter.stages:
+            if hasattr(stage, "_lock"):
+                stage._lock = threading.Lock()
+
+def get_prefilter(trigger_categories: Dict[str, dict]) -> Optional[PreFilter]:
+    """Process-wide pre-filter with the stages named in TREAT_PREFILTER, or None when it is unset."""
+    global _prefilter
+    stages = [name.strip() for name in PREFILTER_STAGES.split(",") if name.strip()]
+    if not stages:
+        return None
+    with _prefilter_lock:
+        if _prefilter is None:
+            built = []
+            for name in stages:
+                if name == "lexicon":
+                    built.append(LexiconStage(DEFAULT_LEXICONS))
+                elif name == "embedding":
+                    built.append(EmbeddingStage({
+                        category: f"{info['mapped_name']}: {info['description']}"
+                        for category, info in trigger_categories.items()
+                    }))
+                else:
+                    logger.warning(f"Unknown pre-filter stage {name!r} ignored")
+            _prefilter = PreFilter(built) if built else None
+        return _prefilter
@@ -0,0 +1,194 @@
+import os
+import gc
+import logging
+import threading
+from typing import Dict, Optional, Tuple, Union
+
+import torch
+from transformers import AutoTokenizer, AutoModelForCausalLM
+
+from model.backends import CPU_BACKEND, TORCH_COMPILE, configure_threads, load_dtype, optimize_for_cpu, resolve_backend
+from model.forking import reset_after_fork
+
+logger = logging.getLogger(__name__)
+
+MODEL_ID = os.environ.get("TREAT_MODEL_ID", "LGAI-EXAONE/EXAONE-Deep-2.4B")
+# Stream weights from memory-mapped safetensors instead of building a randomly initialized copy first
+LOW_MEMORY_LOAD = os.environ.get("TREAT_LOW_MEMORY_LOAD", "1") == "1"
+
+def process_memory(pid: Union[int, str] = "self") -> Dict[str, int]:
+    """Resident, proportional, shared and private bytes of a process, from /proc/<pid>/smaps_rollup.
+
+    Weights loaded before a fork stay in the shared figures of every worker
+    until a worker writes to them. Empty where the file is unavailable.
+    """
+    fields = {
+        "Rss": "rss",
+        "Pss": "pss",
+        "Shared_Clean": "shared_clean",
+        "Shared_Dirty": "shared_dirty",
+        "Private_Clean": "private_clean",
+        "Private_Dirty": "private_dirty"
+    }
+    report = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as rollup:
+            for line in rollup:
+                name, _, value = line.partition(":")
+                if name in fields:
+                    report[fields[name]] = int(value.split()[0]) * 1024
+    except OSError:
+        return {}
+    report["shared"] = report.get("shared_clean", 0) + report.get("shared_dirty", 0)
+    report["private"] = report.get("private_clean", 0) + report.get("private_dirty", 0)
+    return report
+
+class ModelRegistry:
+    """Process-wide holder for the warm tokenizer and model.
+
+    The first caller pays the load cost; every later caller, from any thread or
+    event loop, gets the same instances back until `unload` or `reload` is called.
+    """
+
+    def __init__(
+        self,
+        model_id: str = MODEL_ID,
+        cpu_backend: str = CPU_BACKEND,
+        compile: bool = TORCH_COMPILE,
+        low_memory: bool = LOW_MEMORY_LOAD
+    ):
+        self.model_id = model_id
+        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.cpu_backend = cpu_backend
+        self.compile = compile
+        self.low_memory = low_memory
+        self.backend = None  # numeric backend of the loaded model, e.g. "fp16" or "int8"
+        self.tokenizer = None
+        self.model = None
+        self.load_count = 0
+        self._lock = threading.RLock()
+
+    @property
+    def is_loaded(self) -> bool:
+        return self.model is not None and self.tokenizer is not None
+
+    def get(self, progress=None) -> Tuple[object, object]:
+        """Return the warm (tokenizer, model) pair, loading it on first use."""
+        with self._lock:
+            if not self.is_loaded:
+                self._load(progress)
+            elif progress is not None:
+                progress(0.5, "Model ready")
+            return self.tokenizer, self.model
+
+    def unload(self) -> None:
+        """Drop the model and tokenizer and release their memory."""
+        with self._lock:
+            if not self.is_loaded:
+                return
+            self.model = None
+            self.tokenizer = None
+            gc.collect()
+            if self.device == "cuda":
+                torch.cuda.empty_cache()
+            logger.info(f"Unloaded {self.model_id}")
+
+    def reload(self, progress=None) -> Tuple[object, object]:
+        """Unload and load the model again, e.g. after new weights were published."""
+        with self._lock:
+            self.unload()
+            return self.get(progress)
+
+    def preload(self, progress=None) -> Tuple[object, object]:
+        """Load the model in a parent process before it forks workers.
+
+        Forked workers then share the weight pages copy-on-write. Freezing the
+        garbage collector keeps collections in the children from touching
+        (and so copying) the pages of every object that exists at this point.
+        """
+        pair = self.get(progress)
+        gc.collect()
+        gc.freeze()
+        memory = process_memory()
+        if memory:
+            logger.info(
+                f"Preloaded {self.model_id} for workers: "
+                f"{memory['rss'] / 2**20:.0f} MiB resident, {memory['private'] / 2**20:.0f} MiB private"
+            )
+        return pair
+
+    def available_memory(self) -> Optional[int]:
+        """Free bytes on the model's device, or None when that cannot be determined."""
+        if self.device == "cuda":
+            free, _ = torch.cuda.mem_get_info()
+            return free
+        try:
+            with open("/proc/meminfo") as meminfo:
+                for line in meminfo:
+                    if line.startswith("MemAvailable:"):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+        return None
+
+    def _load(self, progress=None) -> None:
+        try:
+            if progress is not None:
+                progress(0.1, "Loading tokenizer...")
+
+            tokenizer = AutoTokenizer.from_pretrained(
+                self.model_id,
+                use_fast=True,
+                trust_remote_code=True
+            )
+            # Decoder-only generation needs the prompt flush against the new tokens
+            tokenizer.padding_side = "left"
+            if tokenizer.pad_token is None:
+                tokenizer.pad_token = tokenizer.eos_token
+
+            if progress is not None:
+                progress(0.3, "Loading model...")
+
+            if self.device == "cuda":
+                backend, dtype = "fp16", torch.float16
+            else:
+                backend = resolve_backend(self.cpu_backend)
+                dtype = load_dtype(backend)
+                threads = configure_threads()
+                logger.info(f"CPU backend {backend}{' + torch.compile' if self.compile else ''}, {threads} threads")
+
+            load_options = dict(low_cpu_mem_usage=True, use_safetensors=True) if self.low_memory else {}
+            model = AutoModelForCausalLM.from_pretrained(
+                self.model_id,
+                torch_dtype=dtype,
+                device_map="auto",
+                trust_remote_code=True,
+                **load_options
+            )
+            model.eval()
+            if self.device == "cpu":
+                model = optimize_for_cpu(model, backend, self.compile)
+
+            if self.device == "cuda":
+                torch.cuda.empty_cache()
+
+            self.tokenizer = tokenizer
+            self.model = model
+            self.backend = backend
+            self.load_count += 1
+            logger.info(f"Loaded {self.model_id} on {self.device} (load #{self.load_count})")
+
+            if progress is not None:
+                progress(0.5, "Model loaded successfully")
+
+        except Exception as e:
+            logger.error(f"Error loading model: {str(e)}")
+            raise
+
+# Shared by every ContentAnalyzer in this process
+registry = ModelRegistry()
+
+@reset_after_fork
+def _reset_registry_lock() -> None:
+    """A lock held by another thread at fork time would stay held in the child forever."""
+    registry._lock = threading.RLock()
@@ -0,0 +1,59 @@
+import re
+import logging
+from dataclasses import dataclass
+from typing import Iterator, List
+
+from model.chunking import Chunk, encode_with_offsets, pack_segments, token_positions
+
+logger = logging.getLogger(__name__)
+
+# Scene headings as they appear in IMSDb <pre> text, optionally indented and numbered:
+#   "INT. KITCHEN - NIGHT", "  12  EXT./INT. CAR - DAY", "I/E DOCKS"
+SCENE_HEADING = re.compile(
+    r"^[ \t]*(?:\d+[A-Z]?\.?[ \t]+)?(?:INT\.?[ \t]*/[ \t]*EXT|EXT\.?[ \t]*/[ \t]*INT|INT|EXT|I/E)\b\.?[^\n]*$",
+    re.MULTILINE
+)
+
+@dataclass
+class Scene:
+    """A span of a screenplay starting at a scene heading."""
+    index: int
+    heading: str
+    start: int  # character offsets into the source text
+    end: int
+
+def find_scenes(text: str) -> List[Scene]:
+    """Split a screenplay into scenes at INT./EXT. headings in one pass over the text.
+
+    Text before the first heading becomes a scene with an empty heading. A text
+    without any headings comes back as a single scene.
+    """
+    scenes = []
+    starts = [(match.start(), match.group().strip()) for match in SCENE_HEADING.finditer(text)]
+    if not starts or text[:starts[0][0]].strip():
+        starts.insert(0, (0, ""))
+
+    for index, (start, heading) in enumerate(starts):
+        end = starts[index + 1][0] if index + 1 < len(starts) else len(text)
+        scenes.append(Scene(index, heading, start, end))
+    return scenes
+
+def pack_scenes(
+    text: str,
+    scenes: List[Scene],
+    tokenizer,
+    max_tokens: int,
+    overlap_tokens: int = 32
+) -> Iterator[Chunk]:
+    """Pack whole consecutive scenes into chunks of at most `max_tokens` tokens.
+
+    Chunk boundaries always fall on scene headings and are content-defined (see
+    `pack_segments`), so a revision only changes the chunks around edited scenes.
+    A single scene longer than the budget is cut into overlapping token windows.
+    """
+    token_ids, offsets = encode_with_offsets(text, tokenizer)
+    starts = token_positions(offsets, [scene.start for scene in scenes])
+    yield from pack_segments(
+        text, token_ids, offsets, starts, max_tokens, overlap_tokens,
+        labels=[scene.index for scene in scenes]
+    )
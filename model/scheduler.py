@@ -0,0 +1,256 @@
+import os
+import time
+import queue
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+from model.forking import reset_after_fork
+
+logger = logging.getLogger(__name__)
+
+MAX_BATCH_TOKENS = int(os.environ.get("TREAT_MAX_BATCH_TOKENS", "8192"))
+MAX_BATCH_WAIT = float(os.environ.get("TREAT_MAX_BATCH_WAIT", "0.02"))
+
+def is_out_of_memory(error: BaseException) -> bool:
+    """True for allocator failures on either CPU or GPU."""
+    return isinstance(error, MemoryError) or "out of memory" in str(error).lower()
+
+@dataclass
+class _Request:
+    item: object
+    tokens: int
+    future: Future
+    enqueued: float = field(default_factory=time.monotonic)
+
+class AdaptiveBatchSizer:
+    """Tunes a scheduler's padded-token budget at runtime.
+
+    The budget hill-climbs on measured throughput: it keeps moving in the same
+    direction while tokens per second improve and turns around when they drop.
+    It never exceeds what `memory_probe` says is free (at `bytes_per_token`) and
+    halves, with a lowered ceiling, after an out-of-memory error.
+    """
+
+    def __init__(
+        self,
+        initial: int,
+        minimum: int = 256,
+        maximum: int = 65536,
+        bytes_per_token: Optional[int] = None,
+        memory_probe: Optional[Callable[[], Optional[int]]] = None,
+        step: float = 1.25
+    ):
+        self.budget = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.bytes_per_token = bytes_per_token
+        self.memory_probe = memory_probe
+        self.step = step
+        self.out_of_memory = 0
+        self._direction = 1
+        self._last_throughput = None
+
+    def _memory_cap(self) -> int:
+        if not (self.bytes_per_token and self.memory_probe):
+            return self.maximum
+        available = self.memory_probe()
+        if available is None:
+            return self.maximum
+        # Leave half of the free memory for everything else in the process
+        return max(self.minimum, int(available * 0.5 / self.bytes_per_token))
+
+    def observe(self, padded_tokens: int, seconds: float) -> None:
+        """Record one batch; only batches that filled most of the budget say anything about it."""
+        if seconds <= 0 or padded_tokens < 0.8 * self.budget:
+            return
+        throughput = padded_tokens / seconds
+        if self._last_throughput is not None and throughput < 0.95 * self._last_throughput:
+            self._direction = -self._direction
+        self._last_throughput = throughput
+
+        factor = self.step if self._direction > 0 else 1 / self.step
+        ceiling = min(self.maximum, self._memory_cap())
+        self.budget = int(min(ceiling, max(self.minimum, self.budget * factor)))
+
+    def on_out_of_memory(self) -> None:
+        self.out_of_memory += 1
+        self.maximum = max(self.minimum, self.budget // 2)
+        self.budget = self.maximum
+        self._direction = -1
+        self._last_throughput = None
+        logger.warning(f"Out of memory, batch budget lowered to {self.budget} tokens")
+
+class BatchScheduler:
+    """Queue plus worker thread that batches work items from every in-flight analysis.
+
+    Callers submit items (prompts, chunks) with their token length and await the
+    returned future. The worker waits up to `max_wait` seconds after the oldest
+    request arrived, then builds a batch around it from the queued requests of
+    the most similar length, so rows need little padding, up to the sizer's
+    padded-token budget. `runner` gets the items and must return one result per
+    item in order. Batches that run out of memory are split and retried with a
+    smaller budget.
+    """
+
+    def __init__(
+        self,
+        runner: Callable[[List[object]], List[object]],
+        max_batch_tokens: int = MAX_BATCH_TOKENS,
+        max_wait: float = MAX_BATCH_WAIT,
+        name: str = "inference",
+        sizer: Optional[AdaptiveBatchSizer] = None
+    ):
+        self.runner = runner
+        self.max_wait = max_wait
+        self.name = name
+        self.sizer = sizer or AdaptiveBatchSizer(max_batch_tokens)
+        self.batches = 0
+        self.items = 0
+        self.real_tokens = 0
+        self.padded_tokens = 0
+        self._queue: "queue.Queue[Optional[_Request]]" = queue.Queue()
+        self._pending: List[_Request] = []
+        self._stopping = False
+        self._thread = threading.Thread(target=self._work, name=f"treat-{name}", daemon=True)
+        self._thread.start()
+
+    @property
+    def max_batch_tokens(self) -> int:
+        return self.sizer.budget
+
+    def submit(self, item: object, tokens: int) -> Future:
+        """Queue one item; the future resolves to the runner's result for it."""
+        future = Future()
+        self._queue.put(_Request(item, tokens, future))
+        return future
+
+    async def run(self, item: object, tokens: int) -> object:
+        return await asyncio.wrap_future(self.submit(item, tokens))
+
+    def shutdown(self) -> None:
+        self._queue.put(None)
+        self._thread.join()
+
+    def _drain(self, timeout: Optional[float]) -> None:
+        """Move queued requests into the pending pool, waiting up to `timeout` for the first one."""
+        try:
+            request = self._queue.get(timeout=timeout) if timeout is None or timeout > 0 else self._queue.get_nowait()
+            while True:
+                if request is None:
+                    self._stopping = True
+                else:
+                    self._pending.append(request)
+                request = self._queue.get_nowait()
+        except queue.Empty:
+            pass
+
+    def _next_batch(self) -> Optional[List[_Request]]:
+        while not self._pending:
+            if self._stopping:
+                return None
+            self._drain(None)
+
+        oldest = min(self._pending, key=lambda request: request.enqueued)
+        while not self._stopping:
+            remaining = oldest.enqueued + self.max_wait - time.monotonic()
+            if remaining <= 0:
+                break
+            self._drain(remaining)
+        self._drain(0)
+
+        # Grow the batch around the oldest request with the closest lengths first
+        budget = self.max_batch_tokens
+        batch = [oldest]
+        longest = oldest.tokens
+        candidates = sorted(
+            (request for request in self._pending if request is not oldest),
+            key=lambda request: abs(request.tokens - oldest.tokens)
+        )
+        for request in candidates:
+            if max(longest, request.tokens) * (len(batch) + 1) > budget:
+                continue
+            batch.append(request)
+            longest = max(longest, request.tokens)
+
+        chosen = set(map(id, batch))
+        self._pending = [request for request in self._pending if id(request) not in chosen]
+        return batch
+
+    def _run(self, batch: List[_Request]) -> None:
+        padded = max(request.tokens for request in batch) * len(batch)
+        started = time.monotonic()
+        try:
+            results = self.runner([request.item for request in batch])
+        except Exception as e:
+            if is_out_of_memory(e) and len(batch) > 1:
+                self.sizer.on_out_of_memory()
+                middle = len(batch) // 2
+                self._run(batch[:middle])
+                self._run(batch[middle:])
+                return
+            logger.error(f"{self.name} batch of {len(batch)} failed: {str(e)}")
+            for request in batch:
+                request.future.set_exception(e)
+            return
+
+        for request, result in zip(batch, results):
+            request.future.set_result(result)
+        self.sizer.observe(padded, time.monotonic() - started)
+        self.batches += 1
+        self.items += len(batch)
+        self.real_tokens += sum(request.tokens for request in batch)
+        self.padded_tokens += padded
+        if self.batches % 50 == 0:
+            stats = self.stats()
+            logger.info(
+                f"{self.name}: {stats['batches']} batches, mean size {stats['mean_batch_size']:.1f}, "
+                f"pad ratio {stats['pad_ratio']:.1%}, budget {stats['max_batch_tokens']} tokens"
+            )
+
+    def _work(self) -> None:
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            batch = [request for request in batch if request.future.set_running_or_notify_cancel()]
+            if batch:
+                self._run(batch)
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch_size": self.items / self.batches if self.batches else 0.0,
+            "pad_ratio": 1 - self.real_tokens / self.padded_tokens if self.padded_tokens else 0.0,
+            "max_batch_tokens": self.max_batch_tokens,
+            "out_of_memory": self.sizer.out_of_memory,
+            "queued": self._queue.qsize() + len(self._pending)
+        }
+
+_schedulers: Dict[str, BatchScheduler] = {}
+_schedulers_lock = threading.Lock()
+
+@reset_after_fork
+def _forget_schedulers() -> None:
+    """Worker threads do not survive a fork, so a child starts with fresh schedulers."""
+    global _schedulers_lock
+    _schedulers.clear()
+    _schedulers_lock = threading.Lock()
+
+def get_scheduler(
+    name: str,
+    runner: Callable[[List[object]], List[object]],
+    make_sizer: Optional[Callable[[], AdaptiveBatchSizer]] = None,
+    **kwargs
+) -> BatchScheduler:
+    """Process-wide scheduler per kind of work, created with `runner` (and a sizer from `make_sizer`) on first use."""
+    with _schedulers_lock:
+        if name not in _schedulers:
+            if make_sizer is not None:
+                kwargs["sizer"] = make_sizer()
+            _schedulers[name] = BatchScheduler(runner, name=name, **kwargs)
+        return _schedulers[name]
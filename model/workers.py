@@ -0,0 +1,301 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+import traceback
+import multiprocessing
+from collections import deque
+from concurrent.futures import Future
+from multiprocessing.connection import wait
+from typing import Dict, List, Optional
+
+from model.backends import available_cores, configure_threads
+from model.registry import registry, process_memory
+
+logger = logging.getLogger(__name__)
+
+WORKER_PROCESSES = int(os.environ.get("TREAT_WORKERS", "0"))  # 0 analyzes in the API process itself
+WORKER_THREADS = int(os.environ.get("TREAT_WORKER_THREADS", "0"))  # 0: split the available cores evenly
+# Seconds a worker may spend on one job before it is killed and the job re-queued
+WORKER_JOB_TIMEOUT = float(os.environ.get("TREAT_WORKER_JOB_TIMEOUT", "600"))
+
+# Analyzer settings a worker copies from the analyzer that submitted the job
+WORKER_SETTINGS = (
+    "verdict_mode", "prompt_mode", "batch_size", "max_thinking_time", "min_decode_rate", "thinking_budget", "answer_tokens"
+)
+
+_in_worker = False
+
+def _worker_main(worker_id: int, conn, cores: List[int], threads: int, heartbeat_interval: float) -> None:
+    """Worker process: label chunk-category jobs from `conn` with the model inherited from the parent."""
+    global _in_worker
+    _in_worker = True
+    from model.analyzer import ContentAnalyzer
+
+    if cores and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    configure_threads(threads)
+
+    last_beat = time.monotonic()
+
+    def heartbeat(*_) -> None:
+        """Sent while idle and from the progress of a job, so a hung job goes silent."""
+        nonlocal last_beat
+        if time.monotonic() - last_beat >= heartbeat_interval:
+            conn.send(("heartbeat",))
+            last_beat = time.monotonic()
+
+    # Caching, near-duplicate reuse and pre-filtering already happened in the parent
+    analyzer = ContentAnalyzer()
+    analyzer.use_cache = False
+    analyzer.near_dup_threshold = None
+    analyzer.prefilter = None
+    analyzer.use_workers = False
+    analyzer.tokenizer, analyzer.model = registry.get()
+    loop = asyncio.new_event_loop()
+    while True:
+        try:
+            if not conn.poll(heartbeat_interval):
+                heartbeat()
+                continue
+            message = conn.recv()
+        except (EOFError, OSError):
+            break
+        if message is None:
+            break
+        job_id, job = message
+        try:
+            for name, value in job["settings"].items():
+                setattr(analyzer, name, value)
+            analyzer.trigger_categories = job["categories"]
+            verdicts = loop.run_until_complete(analyzer.classify_chunks(job["chunks"], progress=heartbeat))
+            conn.send(("result", job_id, verdicts))
+        except (EOFError, OSError):
+            break
+        except Exception as e:
+            logger.error(f"Worker {worker_id} failed job {job_id}: {traceback.format_exc()}")
+            conn.send(("error", job_id, str(e)))
+
+class _Worker:
+    def __init__(self, worker_id: int, cores: List[int], threads: int):
+        self.worker_id = worker_id
+        self.cores = cores
+        self.threads = threads
+        self.process = None
+        self.conn = None
+        self.job = None  # (job_id, job, future, attempts) while busy
+        self.job_started = 0.0
+        self.last_seen = 0.0
+        self.restarts = -1
+
+class WorkerPool:
+    """Processes that label chunk-category jobs, each pinned to its own cores.
+
+    The model is preloaded before the workers fork, so they share its weights.
+    Jobs wait in the parent until a worker is idle; a job cancelled before then
+    never runs. A supervisor thread routes results back to the submitters'
+    futures. It restarts a worker that died, stopped sending heartbeats or
+    spent more than `job_timeout` seconds on one job, and re-queues that
+    worker's job up to `max_attempts` times. A busy worker only sends
+    heartbeats as its job makes progress, so `heartbeat_timeout` must exceed
+    the longest generation batch.
+    """
+
+    def __init__(
+        self,
+        processes: int = WORKER_PROCESSES,
+        threads_per_worker: int = WORKER_THREADS,
+        heartbeat_interval: float = 2.0,
+        heartbeat_timeout: float = 90.0,
+        job_timeout: float = WORKER_JOB_TIMEOUT,
+        max_attempts: int = 3
+    ):
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        self.job_timeout = job_timeout
+        self.max_attempts = max_attempts
+        self.completed = 0
+        self.failed = 0
+        self._context = multiprocessing.get_context("fork")
+        self._backlog = deque()
+        self._lock = threading.Lock()
+        self._next_job = 0
+        self._stopping = False
+
+        try:
+            cores = sorted(os.sched_getaffinity(0))
+        except AttributeError:
+            cores = list(range(available_cores()))
+        processes = max(1, processes)
+        share = max(1, len(cores) // processes)
+        self._workers = []
+        for worker_id in range(processes):
+            # Pin to a disjoint slice of cores when there are enough of them
+            slice_ = cores[worker_id * share:(worker_id + 1) * share] if len(cores) >= processes else []
+            self._workers.append(_Worker(worker_id, slice_, threads_per_worker or max(1, len(slice_) or 1)))
+
+        registry.preload()
+        for worker in self._workers:
+            self._start(worker)
+        self._thread = threading.Thread(target=self._supervise, name="treat-workers", daemon=True)
+        self._thread.start()
+        logger.info(f"Started {processes} analysis workers with {self._workers[0].threads} threads each")
+
+    def _start(self, worker: _Worker) -> None:
+        parent_conn, child_conn = self._context.Pipe()
+        worker.process = self._context.Process(
+            target=_worker_main,
+            args=(worker.worker_id, child_conn, worker.cores, worker.threads, self.heartbeat_interval),
+            name=f"treat-worker-{worker.worker_id}",
+            daemon=True
+        )
+        worker.process.start()
+        child_conn.close()
+        worker.conn = parent_conn
+        worker.last_seen = time.monotonic()
+        worker.restarts += 1
+
+    def submit(self, job: dict) -> Future:
+        """Queue a job of `chunks`, `categories` and analyzer `settings`; resolves to its verdicts."""
+        future = Future()
+        with self._lock:
+            job_id = self._next_job
+            self._next_job += 1
+            self._backlog.append((job_id, job, future, 0))
+        return future
+
+    async def run(self, job: dict) -> Dict[str, List[Optional[str]]]:
+        return await asyncio.wrap_future(self.submit(job))
+
+    def _finish(self, worker: _Worker, message: tuple) -> None:
+        kind, job_id, payload = message
+        if worker.job is None or worker.job[0] != job_id:
+            return
+        future = worker.job[2]
+        worker.job = None
+        if kind == "result":
+            self.completed += 1
+            future.set_result(payload)
+        else:
+            self.failed += 1
+            future.set_exception(RuntimeError(payload))
+
+    def _check_health(self) -> None:
+        now = time.monotonic()
+        for worker in self._workers:
+            alive = worker.process.is_alive()
+            if not alive:
+                reason = "exited"
+            elif now - worker.last_seen >= self.heartbeat_timeout:
+                reason = f"sent no heartbeat for {now - worker.last_seen:.0f}s"
+            elif worker.job is not None and now - worker.job_started >= self.job_timeout:
+                reason = f"spent over {self.job_timeout:.0f}s on job {worker.job[0]}"
+            else:
+                continue
+            logger.warning(f"Worker {worker.worker_id} (pid {worker.process.pid}) {reason}, restarting")
+            if alive:
+                worker.process.kill()
+            worker.process.join(timeout=5)
+            worker.conn.close()
+            if worker.job is not None:
+                job_id, job, future, attempts = worker.job
+                worker.job = None
+                if attempts + 1 >= self.max_attempts:
+                    self.failed += 1
+                    future.set_exception(RuntimeError(f"Job {job_id} lost with {self.max_attempts} workers"))
+                else:
+                    with self._lock:
+                        self._backlog.appendleft((job_id, job, future, attempts + 1))
+            self._start(worker)
+
+    def _dispatch(self) -> None:
+        for worker in self._workers:
+            if worker.job is not None:
+                continue
+            while True:
+                with self._lock:
+                    if not self._backlog:
+                        return
+                    entry = self._backlog.popleft()
+                future = entry[2]
+                # A re-queued job is already running from its future's point of view
+                if future.running() or future.set_running_or_notify_cancel():
+                    break
+            worker.job = entry
+            worker.job_started = time.monotonic()
+            try:
+                worker.conn.send((entry[0], entry[1]))
+            except OSError:
+                pass  # the health check restarts the worker and re-queues the job
+
+    def _supervise(self) -> None:
+        while not self._stopping:
+            connections = {worker.conn: worker for worker in self._workers}
+            for conn in wait(list(connections), timeout=0.05):
+                worker = connections[conn]
+                try:
+                    while conn.poll():
+                        message = conn.recv()
+                        worker.last_seen = time.monotonic()
+                        if message[0] != "heartbeat":
+                            self._finish(worker, message)
+                except (EOFError, OSError):
+                    pass  # a dead worker is handled by the health check
+            self._check_health()
+            self._dispatch()
+
+    def health(self) -> List[dict]:
+        """Per-worker liveness, current job and memory, resident versus shared."""
+        now = time.monotonic()
+        report = []
+        for worker in self._workers:
+            memory = process_memory(worker.process.pid)
+            report.append({
+                "worker": worker.worker_id,
+                "pid": worker.process.pid,
+                "alive": worker.process.is_alive(),
+                "busy": worker.job is not None,
+                "heartbeat_age": round(now - worker.last_seen, 1),
+                "restarts": worker.restarts,
+                "cores": worker.cores,
+                "threads": worker.threads,
+                "rss_bytes": memory.get("rss"),
+                "shared_bytes": memory.get("shared"),
+                "private_bytes": memory.get("private")
+            })
+        return report
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "workers": len(self._workers),
+            "completed": self.completed,
+            "failed": self.failed,
+            "queued": len(self._backlog),
+            "busy": sum(worker.job is not None for worker in self._workers)
+        }
+
+    def shutdown(self) -> None:
+        self._stopping = True
+        self._thread.join()
+        for worker in self._workers:
+            try:
+                worker.conn.send(None)
+            except OSError:
+                pass
+            worker.process.join(timeout=5)
+            if worker.process.is_alive():
+                worker.process.kill()
+
+_worker_pool: Optional[WorkerPool] = None
+_worker_pool_lock = threading.Lock()
+
+def get_worker_pool() -> Optional[WorkerPool]:
+    """Process-wide pool when TREAT_WORKERS is set, started on first use; None inside a worker."""
+    global _worker_pool
+    if WORKER_PROCESSES <= 0 or _in_worker:
+        return None
+    with _worker_pool_lock:
+        if _worker_pool is None:
+            _worker_pool = WorkerPool()
+        return _worker_pool
@@ -0,0 +1,284 @@
+# script_mirror.py
+import os
+import time
+import zlib
+import sqlite3
+import logging
+import argparse
+import threading
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Callable, Dict, Optional, Tuple
+from urllib.parse import unquote, urljoin, urlparse
+
+import requests
+from bs4 import BeautifulSoup
+
+from model.cache import CACHE_DIR
+
+try:
+    import zstandard
+except ImportError:  # zlib is always available
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+BASE_URL = "https://imsdb.com"
+ALL_SCRIPTS_URL = f"{BASE_URL}/all-scripts.html"
+
+# SQLite file holding the mirror; empty keeps it in memory for the life of the process
+MIRROR_PATH = os.environ.get("TREAT_MIRROR_PATH", os.path.join(CACHE_DIR, "imsdb.sqlite") if CACHE_DIR else "")
+# Seconds before a mirrored page is revalidated with a conditional request
+MIRROR_MAX_AGE = float(os.environ.get("TREAT_MIRROR_MAX_AGE", str(24 * 3600)))
+
+# A fetch takes a URL and request headers and returns (status, body, response headers)
+Fetch = Callable[[str, Dict[str, str]], Tuple[int, str, Dict[str, str]]]
+
+def http_fetch(url: str, headers: Dict[str, str]) -> Tuple[int, str, Dict[str, str]]:
+    response = requests.get(url, headers=headers, timeout=30)
+    if response.status_code != 304:
+        response.raise_for_status()
+    return response.status_code, response.text, dict(response.headers)
+
+class FixtureFetch:
+    """Serves IMSDb URLs from a local directory laid out like the site, for offline builds and tests.
+
+    `https://imsdb.com/Movie Scripts/Alien Script.html` maps to
+    `<directory>/Movie Scripts/Alien Script.html`. Files carry their mtime as
+    Last-Modified and answer If-Modified-Since with 304.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def __call__(self, url: str, headers: Dict[str, str]) -> Tuple[int, str, Dict[str, str]]:
+        path = os.path.join(self.directory, unquote(urlparse(url).path).lstrip("/"))
+        if not os.path.isfile(path):
+            raise requests.HTTPError(f"404 Not Found: {url}")
+        modified = int(os.path.getmtime(path))
+        since = headers.get("If-Modified-Since")
+        if since and parsedate_to_datetime(since).timestamp() >= modified:
+            return 304, "", {}
+        with open(path, encoding="utf-8", errors="replace") as handle:
+            return 200, handle.read(), {"Last-Modified": formatdate(modified, usegmt=True)}
+
+def compress(text: str) -> Tuple[str, bytes]:
+    data = text.encode("utf-8")
+    if zstandard is not None:
+        return "zstd", zstandard.ZstdCompressor(level=10).compress(data)
+    return "zlib", zlib.compress(data, 9)
+
+def decompress(codec: str, blob: bytes) -> str:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("Mirror entry is zstd-compressed but zstandard is not installed")
+        return zstandard.ZstdDecompressor().decompress(blob).decode("utf-8")
+    return zlib.decompress(blob).decode("utf-8")
+
+def parse_title_index(html: str) -> Dict[str, str]:
+    """Lowercased title to movie page URL, from the all-scripts page."""
+    soup = BeautifulSoup(html, 'html.parser')
+    return {
+        link.text.strip().lower(): urljoin(BASE_URL, link['href'])
+        for link in soup.find_all('a', href=True)
+        if "/Movie Scripts/" in unquote(link['href']) and link.text.strip()
+    }
+
+def find_script_link(soup: BeautifulSoup, movie_name: str) -> str | None:
+    """Find the script download link for a given movie."""
+    patterns = [
+        f'Read "{movie_name}" Script',
+        f'Read "{movie_name.title()}" Script',
+        f'Read "{movie_name.upper()}" Script',
+        f'Read "{movie_name.lower()}" Script'
+    ]
+
+    for link in soup.find_all('a', href=True):
+        link_text = link.text.strip()
+        if any(pattern.lower() in link_text.lower() for pattern in patterns):
+            return link['href']
+        elif all(word.lower() in link_text.lower() for word in ["Read", "Script", movie_name]):
+            return link['href']
+    return None
+
+def extract_script_text(html: str) -> str | None:
+    script_content = BeautifulSoup(html, 'html.parser').find('pre')
+    return script_content.get_text() if script_content else None
+
+class ScriptMirror:
+    """Local copy of IMSDb: the title index, each title's script URL and the script texts.
+
+    Texts are stored compressed (zstd when installed, else zlib) in SQLite.
+    Entries older than `max_age` are revalidated with ETag/Last-Modified
+    conditional requests; when the site cannot be reached the stale copy is
+    served. Safe to share between threads.
+    """
+
+    def __init__(self, path: str = MIRROR_PATH, fetch: Fetch = http_fetch, max_age: float = MIRROR_MAX_AGE):
+        self.path = path or ":memory:"
+        self.fetch = fetch
+        self.max_age = max_age
+        self.requests = 0
+        self.not_modified = 0
+        self._titles: Optional[Dict[str, str]] = None
+        self._lock = threading.Lock()
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            "url TEXT PRIMARY KEY, codec TEXT NOT NULL, body BLOB NOT NULL, "
+            "etag TEXT, last_modified TEXT, fetched REAL NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS titles (title TEXT PRIMARY KEY, movie_url TEXT NOT NULL, script_url TEXT)"
+        )
+        self._db.commit()
+
+    def _page(self, url: str, transform: Callable[[str], Optional[str]] = lambda html: html) -> Tuple[Optional[str], bool]:
+        """A page's stored body after `transform`, fetched or revalidated if needed; also whether it changed."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT codec, body, etag, last_modified, fetched FROM pages WHERE url = ?", (url,)
+            ).fetchone()
+        if row is not None and time.time() - row[4] < self.max_age:
+            return decompress(row[0], row[1]), False
+
+        headers = {}
+        if row is not None:
+            if row[2]:
+                headers["If-None-Match"] = row[2]
+            if row[3]:
+                headers["If-Modified-Since"] = row[3]
+        try:
+            self.requests += 1
+            status, html, response_headers = self.fetch(url, headers)
+        except requests.RequestException as e:
+            if row is None:
+                raise
+            logger.warning(f"Could not revalidate {url}, serving the mirrored copy: {str(e)}")
+            return decompress(row[0], row[1]), False
+
+        if status == 304 and row is not None:
+            self.not_modified += 1
+            with self._lock:
+                self._db.execute("UPDATE pages SET fetched = ? WHERE url = ?", (time.time(), url))
+                self._db.commit()
+            return decompress(row[0], row[1]), False
+
+        body = transform(html)
+        if body is None:
+            return None, False
+        codec, blob = compress(body)
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO pages (url, codec, body, etag, last_modified, fetched) VALUES (?, ?, ?, ?, ?, ?)",
+                (url, codec, blob, response_headers.get("ETag"), response_headers.get("Last-Modified"), time.time())
+            )
+            self._db.commit()
+        return body, True
+
+    def titles(self) -> Dict[str, str]:
+        """The title index: lowercased title to movie page URL, rebuilt when the index page changed."""
+        if self._titles is not None:
+            # A fresh copy needs neither the stored page nor a request
+            with self._lock:
+                row = self._db.execute("SELECT fetched FROM pages WHERE url = ?", (ALL_SCRIPTS_URL,)).fetchone()
+            if row is not None and time.time() - row[0] < self.max_age:
+                return self._titles
+        html, changed = self._page(ALL_SCRIPTS_URL)
+        if changed:
+            self._store_titles(parse_title_index(html))
+        if changed or self._titles is None:
+            with self._lock:
+                self._titles = dict(self._db.execute("SELECT title, movie_url FROM titles").fetchall())
+        return self._titles
+
+    def _store_titles(self, titles: Dict[str, str]) -> None:
+        with self._lock:
+            known = dict(self._db.execute("SELECT title, movie_url FROM titles").fetchall())
+            self._db.executemany("DELETE FROM titles WHERE title = ?", [(title,) for title in known if title not in titles])
+            # A title keeps its resolved script URL while its movie page stays the same
+            self._db.executemany(
+                "INSERT OR REPLACE INTO titles (title, movie_url, script_url) VALUES (?, ?, NULL)",
+                [(title, url) for title, url in titles.items() if known.get(title) != url]
+            )
+            self._db.commit()
+        logger.info(f"Mirrored IMSDb title index with {len(titles)} titles")
+
+    def script_url(self, movie_url: str, movie_name: str) -> Optional[str]:
+        """The script page URL linked from a movie page, looked up once per title."""
+        with self._lock:
+            row = self._db.execute("SELECT script_url FROM titles WHERE movie_url = ?", (movie_url,)).fetchone()
+        if row is not None and row[0]:
+            return row[0]
+        self.requests += 1
+        _, html, _ = self.fetch(movie_url, {})
+        script_link = find_script_link(BeautifulSoup(html, 'html.parser'), movie_name)
+        if not script_link:
+            return None
+        script_url = urljoin(BASE_URL, script_link)
+        with self._lock:
+            self._db.execute("UPDATE titles SET script_url = ? WHERE movie_url = ?", (script_url, movie_url))
+            self._db.commit()
+        return script_url
+
+    def script(self, script_url: str) -> Optional[str]:
+        """A script's text, stored compressed and revalidated once it is older than `max_age`."""
+        text, _ = self._page(script_url, extract_script_text)
+        return text
+
+    def crawl(self, limit: Optional[int] = None) -> Dict[str, int]:
+        """Mirror every title's script (or the first `limit`), skipping the ones already stored."""
+        crawled = failed = 0
+        for title, movie_url in sorted(self.titles().items())[:limit]:
+            try:
+                script_url = self.script_url(movie_url, title)
+                if script_url and self.script(script_url) is not None:
+                    crawled += 1
+                else:
+                    failed += 1
+            except requests.RequestException as e:
+                logger.warning(f"Could not mirror '{title}': {str(e)}")
+                failed += 1
+        return {"crawled": crawled, "failed": failed}
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            titles, resolved = self._db.execute("SELECT COUNT(*), COUNT(script_url) FROM titles").fetchone()
+            pages, stored = self._db.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(body)), 0) FROM pages").fetchone()
+        return {
+            "titles": titles,
+            "resolved_titles": resolved,
+            "pages": pages,
+            "stored_bytes": stored,
+            "requests": self.requests,
+            "not_modified": self.not_modified
+        }
+
+_mirror: Optional[ScriptMirror] = None
+_mirror_lock = threading.Lock()
+
+def get_mirror() -> ScriptMirror:
+    """Process-wide mirror at TREAT_MIRROR_PATH."""
+    global _mirror
+    with _mirror_lock:
+        if _mirror is None:
+            _mirror = ScriptMirror()
+        return _mirror
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or refresh the local IMSDb mirror")
+    parser.add_argument("--path", default=MIRROR_PATH or None, help="SQLite file of the mirror")
+    parser.add_argument("--fixtures", help="build from a directory of saved IMSDb pages instead of the site")
+    parser.add_argument("--limit", type=int, help="mirror only the first N titles")
+    parser.add_argument("--refresh", action="store_true", help="revalidate every stored page now")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if not args.path:
+        parser.error("--path is required when TREAT_MIRROR_PATH is empty")
+    fetch = FixtureFetch(args.fixtures) if args.fixtures else http_fetch
+    mirror = ScriptMirror(args.path, fetch, max_age=0 if args.refresh else MIRROR_MAX_AGE)
+    print(mirror.crawl(args.limit))
+    print(mirror.stats())
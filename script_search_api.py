@@ -1,16 +1,23 @@
 # script_search_api.py
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
+import os
+import json
 import asyncio
+import hmac
+import hashlib
 from datetime import datetime, timedelta
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 from pydantic import BaseModel
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 import logging
 import requests
-from bs4 import BeautifulSoup
-from difflib import get_close_matches
 from model.analyzer import analyze_content
+from model.workers import WORKER_PROCESSES, get_worker_pool
+from model.distributed import COORDINATOR_TOKEN, get_coordinator
+from script_mirror import get_mirror
+from title_index import get_title_index
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -34,6 +41,8 @@ class ProgressState:
     is_complete: bool = False
     result: Optional[dict] = None
     error: Optional[str] = None
+    # Categories whose outcome is already final, by mapped name: whether they are detected
+    partial_results: Dict[str, bool] = field(default_factory=dict)
 
 class ProgressResponse(BaseModel):
     progress: float
@@ -41,12 +50,47 @@ class ProgressResponse(BaseModel):
     is_complete: bool
     result: Optional[dict] = None
     error: Optional[str] = None
+    partial_results: Dict[str, bool] = {}
+
+class LeaseRequest(BaseModel):
+    worker_id: str
+    max_jobs: int = 1
+
+class HeartbeatRequest(BaseModel):
+    worker_id: str
+    job_ids: List[int]
+
+class CompleteRequest(BaseModel):
+    worker_id: str
+    verdicts: Dict[str, List[Optional[str]]]
+
+class FailRequest(BaseModel):
+    worker_id: str
+    error: str
+
+class BatchItem(BaseModel):
+    title: Optional[str] = None
+    text: Optional[str] = None
+
+class BatchRequest(BaseModel):
+    items: List[BatchItem]
+    detect_only: bool = False
 
 # Global progress tracker
 progress_tracker: Dict[str, ProgressState] = {}
+# Single-flight state: the task id running per normalized title, and shared work per URL or content hash
+title_tasks: Dict[str, str] = {}
+in_flight: Dict[str, asyncio.Future] = {}
+# Tasks waiting on each shared analysis, and the category outcomes it reported so far
+category_listeners: Dict[str, List[str]] = {}
+category_results: Dict[str, Dict[str, bool]] = {}
+# Open progress streams per task; each gets every new ProgressState
+subscribers: Dict[str, List[asyncio.Queue]] = {}
+event_loop: Optional[asyncio.AbstractEventLoop] = None
 
-BASE_URL = "https://imsdb.com"
-ALL_SCRIPTS_URL = f"{BASE_URL}/all-scripts.html"
+MAX_BATCH_ITEMS = int(os.environ.get("TREAT_MAX_BATCH_ITEMS", "500"))
+# Items analyzed at once; their chunks share the model's batches, so more in flight means fuller batches
+BATCH_CONCURRENCY = int(os.environ.get("TREAT_BATCH_CONCURRENCY", "8"))
 
 def create_task_id(movie_name: str) -> str:
     """Create a unique task ID for a movie analysis request"""
@@ -56,24 +100,35 @@ async def cleanup_old_tasks():
     """Remove tasks older than 1 hour"""
     while True:
         current_time = datetime.now()
+        # Worker threads add tasks through update_progress while this runs, so iterate over a snapshot
         expired_tasks = [
-            task_id for task_id, state in progress_tracker.items()
+            task_id for task_id, state in list(progress_tracker.items())
             if current_time - state.timestamp > timedelta(hours=1)
         ]
         for task_id in expired_tasks:
-            del progress_tracker[task_id]
+            progress_tracker.pop(task_id, None)
         await asyncio.sleep(300)  # Cleanup every 5 minutes
 
 @app.on_event("startup")
 async def startup_event():
     """Initialize the server and start cleanup task"""
+    global event_loop
+    event_loop = asyncio.get_running_loop()
     progress_tracker.clear()
     asyncio.create_task(cleanup_old_tasks())
     logger.info("Server started, progress tracker initialized")
 
+def publish(state: ProgressState):
+    """Push a task's new state to its open progress streams; safe to call from any thread"""
+    if event_loop is None:
+        return
+    for queue in list(subscribers.get(state.task_id, [])):
+        event_loop.call_soon_threadsafe(queue.put_nowait, state)
+
 def update_progress(task_id: str, progress: float, status: str, result: Optional[dict] = None, error: Optional[str] = None):
     """Update progress state for a task"""
     is_complete = progress >= 1.0
+    previous = progress_tracker.get(task_id)
     progress_tracker[task_id] = ProgressState(
         progress=progress,
         status=status,
@@ -81,20 +136,47 @@ def update_progress(task_id: str, progress: float, status: str, result: Optional
         task_id=task_id,
         is_complete=is_complete,
         result=result,
-        error=error
+        error=error,
+        partial_results=dict(previous.partial_results) if previous else {}
     )
+    publish(progress_tracker[task_id])
     logger.info(f"Task {task_id}: {status} (Progress: {progress * 100:.0f}%)")
 
+def report_category(task_id: str, category: str, detected: bool):
+    """Record a category's final outcome before the whole analysis ends"""
+    state = progress_tracker.get(task_id)
+    if state is None:
+        return
+    state.partial_results[category] = detected
+    publish(state)
+
+def progress_response(state: ProgressState) -> ProgressResponse:
+    return ProgressResponse(
+        progress=state.progress,
+        status=state.status,
+        is_complete=state.is_complete,
+        result=state.result,
+        error=state.error,
+        partial_results=state.partial_results
+    )
+
 @app.get("/api/start_analysis")
 async def start_analysis(movie_name: str):
-    """Start a new analysis task"""
+    """Start a new analysis task, or attach to the one already running for this title"""
+    title = normalize_title(movie_name)
+    task_id = title_tasks.get(title)
+    if task_id in progress_tracker:
+        logger.info(f"Attaching request for '{movie_name}' to in-flight task {task_id}")
+        return {"task_id": task_id, "coalesced": True}
+
     task_id = create_task_id(movie_name)
+    title_tasks[title] = task_id
     update_progress(task_id, 0.0, "Starting analysis...")
     
     # Start the analysis task in the background
     asyncio.create_task(run_analysis(task_id, movie_name))
     
-    return {"task_id": task_id}
+    return {"task_id": task_id, "coalesced": False}
 
 @app.get("/api/progress/{task_id}")
 async def get_progress(task_id: str) -> ProgressResponse:
@@ -102,117 +184,247 @@ async def get_progress(task_id: str) -> ProgressResponse:
     if task_id not in progress_tracker:
         raise HTTPException(status_code=404, detail="Task not found")
     
-    state = progress_tracker[task_id]
-    return ProgressResponse(
-        progress=state.progress,
-        status=state.status,
-        is_complete=state.is_complete,
-        result=state.result,
-        error=state.error
-    )
+    return progress_response(progress_tracker[task_id])
+
+@app.get("/api/progress/{task_id}/stream")
+async def stream_progress(task_id: str):
+    """Server-sent events with the task's progress, pushed on every change until it completes"""
+    if task_id not in progress_tracker:
+        raise HTTPException(status_code=404, detail="Task not found")
+    queue = asyncio.Queue()
+    subscribers.setdefault(task_id, []).append(queue)
+
+    async def events():
+        try:
+            state = progress_tracker.get(task_id)
+            while state is not None:
+                yield f"data: {json.dumps(progress_response(state).model_dump())}\n\n"
+                if state.is_complete:
+                    break
+                try:
+                    state = await asyncio.wait_for(queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    state = progress_tracker.get(task_id)
+                    continue
+                # Only the newest of a burst of updates matters
+                while not queue.empty():
+                    state = queue.get_nowait()
+        finally:
+            subscribers[task_id].remove(queue)
+            if not subscribers[task_id]:
+                del subscribers[task_id]
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.get("/api/workers")
+async def get_workers():
+    """Health of the analysis worker processes, when TREAT_WORKERS enables them"""
+    if WORKER_PROCESSES <= 0:
+        return {"enabled": False}
+    pool = await asyncio.to_thread(get_worker_pool)
+    return {"enabled": True, "stats": pool.stats(), "workers": pool.health()}
+
+def require_coordinator(token: Optional[str]):
+    """The coordinator, after checking the worker's shared token"""
+    coordinator = get_coordinator()
+    if coordinator is None:
+        # Also the case when TREAT_COORDINATOR_TOKEN is unset: the job endpoints never run without it
+        raise HTTPException(status_code=404, detail="This server is not a coordinator")
+    if not hmac.compare_digest(token or "", COORDINATOR_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid worker token")
+    return coordinator
+
+@app.post("/api/jobs/lease")
+async def lease_jobs(request: LeaseRequest, x_treat_token: Optional[str] = Header(None)):
+    """Hand a remote worker its next jobs"""
+    coordinator = require_coordinator(x_treat_token)
+    return {"jobs": coordinator.lease(request.worker_id, request.max_jobs)}
+
+@app.post("/api/jobs/heartbeat")
+async def heartbeat_jobs(request: HeartbeatRequest, x_treat_token: Optional[str] = Header(None)):
+    """Extend the leases a remote worker still holds"""
+    coordinator = require_coordinator(x_treat_token)
+    return coordinator.heartbeat(request.worker_id, request.job_ids)
+
+@app.post("/api/jobs/{job_id}/complete")
+async def complete_job(job_id: int, request: CompleteRequest, x_treat_token: Optional[str] = Header(None)):
+    """Accept a job's verdicts from a remote worker"""
+    coordinator = require_coordinator(x_treat_token)
+    try:
+        return {"accepted": coordinator.complete(request.worker_id, job_id, request.verdicts)}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/api/jobs/{job_id}/fail")
+async def fail_job(job_id: int, request: FailRequest, x_treat_token: Optional[str] = Header(None)):
+    """A remote worker gave up on a job"""
+    coordinator = require_coordinator(x_treat_token)
+    return {"accepted": coordinator.fail(request.worker_id, job_id, request.error)}
+
+@app.get("/api/suggest")
+async def suggest_titles(query: str, k: int = 5):
+    """Ranked titles matching a partial or misspelled query"""
+    movie_links = await asyncio.to_thread(get_mirror().titles)
+    matches = get_title_index(movie_links).search(query, k=min(max(k, 1), 50))
+    return {"suggestions": [{"title": title, "score": score} for title, score in matches]}
+
+@app.get("/api/mirror")
+async def mirror_stats():
+    """Size and freshness counters of the local IMSDb mirror"""
+    return await asyncio.to_thread(get_mirror().stats)
+
+@app.get("/api/jobs/stats")
+async def job_stats():
+    """Queue, lease and worker state of the coordinator"""
+    coordinator = get_coordinator()
+    if coordinator is None:
+        return {"enabled": False}
+    return {"enabled": True, **coordinator.stats()}
 
-def find_movie_link(movie_name: str, soup: BeautifulSoup) -> str | None:
-    """Find the closest matching movie link from the script database."""
-    movie_links = {link.text.strip().lower(): link['href'] for link in soup.find_all('a', href=True)}
-    close_matches = get_close_matches(movie_name.lower(), movie_links.keys(), n=1, cutoff=0.6)
+def find_movie_link(movie_name: str, movie_links: Dict[str, str]) -> str | None:
+    """Find the closest matching movie link in the title index (lowercased title to movie page URL)."""
+    close_match = get_title_index(movie_links).best(movie_name)
     
-    if close_matches:
-        logger.info(f"Close match found: {close_matches[0]}")
-        return BASE_URL + movie_links[close_matches[0]]
+    if close_match:
+        logger.info(f"Close match found: {close_match}")
+        return movie_links[close_match]
     
     logger.info("No close match found.")
     return None
 
-def find_script_link(soup: BeautifulSoup, movie_name: str) -> str | None:
-    """Find the script download link for a given movie."""
-    patterns = [
-        f'Read "{movie_name}" Script',
-        f'Read "{movie_name.title()}" Script',
-        f'Read "{movie_name.upper()}" Script',
-        f'Read "{movie_name.lower()}" Script'
-    ]
-    
-    for link in soup.find_all('a', href=True):
-        link_text = link.text.strip()
-        if any(pattern.lower() in link_text.lower() for pattern in patterns):
-            return link['href']
-        elif all(word.lower() in link_text.lower() for word in ["Read", "Script", movie_name]):
-            return link['href']
-    return None
+def resolve_script_url(movie_name: str) -> str | None:
+    """Find the URL of the script page for a given movie in the local IMSDb mirror."""
+    mirror = get_mirror()
 
-def fetch_script(movie_name: str) -> str | None:
-    """Fetch and extract the script content for a given movie."""
-    # Initial page load
-    update_progress(movie_name, 0.1, "Fetching the script database...")
+    # Title index, refreshed from the site only when it went stale
+    update_progress(movie_name, 0.1, "Searching the script database...")
     try:
-        response = requests.get(ALL_SCRIPTS_URL)
-        response.raise_for_status()
+        movie_links = mirror.titles()
     except requests.RequestException as e:
         logger.error(f"Failed to load the main page: {str(e)}")
         return None
 
-    # Search for movie
-    update_progress(movie_name, 0.2, "Searching for the movie...")
-    soup = BeautifulSoup(response.text, 'html.parser')
-    movie_link = find_movie_link(movie_name, soup)
-    
+    movie_link = find_movie_link(movie_name, movie_links)
     if not movie_link:
         logger.error(f"Script for '{movie_name}' not found.")
         return None
 
-    # Fetch movie page
-    update_progress(movie_name, 0.3, "Loading movie details...")
+    # Fetched from the movie page on a title's first lookup only
+    update_progress(movie_name, 0.3, "Locating script download...")
     try:
-        response = requests.get(movie_link)
-        response.raise_for_status()
+        script_page_url = mirror.script_url(movie_link, movie_name)
     except requests.RequestException as e:
         logger.error(f"Failed to load the movie page: {str(e)}")
         return None
 
-    # Find script link
-    update_progress(movie_name, 0.4, "Locating script download...")
-    soup = BeautifulSoup(response.text, 'html.parser')
-    script_link = find_script_link(soup, movie_name)
-
-    if not script_link:
+    if not script_page_url:
         logger.error(f"Unable to find script link for '{movie_name}'.")
         return None
 
-    # Fetch script content
-    script_page_url = BASE_URL + script_link
-    update_progress(movie_name, 0.5, "Downloading script content...")
-    
+    return script_page_url
+
+def download_script(script_page_url: str) -> str | None:
+    """Read a script's text from the local mirror, downloading it on first use."""
     try:
-        response = requests.get(script_page_url)
-        response.raise_for_status()
+        script_text = get_mirror().script(script_page_url)
     except requests.RequestException as e:
         logger.error(f"Failed to load the script: {str(e)}")
         return None
 
-    # Extract script text
-    update_progress(movie_name, 0.6, "Extracting script text...")
-    soup = BeautifulSoup(response.text, 'html.parser')
-    script_content = soup.find('pre')
-    
-    if script_content:
-        update_progress(movie_name, 0.7, "Script extracted successfully")
-        return script_content.get_text()
-    else:
+    if not script_text:
         logger.error("Failed to extract script content.")
+    return script_text
+
+def fetch_script(movie_name: str) -> str | None:
+    """Fetch and extract the script content for a given movie."""
+    script_page_url = resolve_script_url(movie_name)
+    if not script_page_url:
         return None
 
+    update_progress(movie_name, 0.5, "Reading script content...")
+    script_text = download_script(script_page_url)
+    if script_text:
+        update_progress(movie_name, 0.7, "Script extracted successfully")
+    return script_text
+
+def normalize_title(movie_name: str) -> str:
+    return " ".join(movie_name.lower().split())
+
+async def single_flight(key: str, factory):
+    """Await the in-flight task for `key`, starting it with `factory()` if there is none.
+
+    Callers that give up waiting do not cancel the shared task.
+    """
+    task = in_flight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(factory())
+        in_flight[key] = task
+        task.add_done_callback(lambda _: in_flight.pop(key, None))
+    else:
+        logger.info(f"Joining in-flight work for {key}")
+    return await asyncio.shield(task)
+
+async def analyze_script_text(script_text: str, detect_only: bool = False, task_id: Optional[str] = None) -> dict:
+    """Analyze a script, sharing one model run between identical texts in flight
+
+    Category outcomes and the analysis progress are reported to `task_id` as
+    they come, also when it joined a run another task started.
+    """
+    content_hash = hashlib.sha256(script_text.encode("utf-8")).hexdigest()
+    key = f"sha256:{content_hash}:{int(detect_only)}"
+
+    def on_category(category: str, detected: bool):
+        if key not in category_listeners:
+            return
+        category_results.setdefault(key, {})[category] = detected
+        for listener in category_listeners[key]:
+            report_category(listener, category, detected)
+
+    def on_progress(value: float, status: str):
+        # The analysis covers the listeners' range from 0.6 until the result is stored at 1.0
+        for listener in list(category_listeners.get(key, [])):
+            update_progress(listener, 0.6 + 0.35 * min(value, 1.0), status)
+
+    if task_id is not None:
+        category_listeners.setdefault(key, []).append(task_id)
+        for category, detected in category_results.get(key, {}).items():
+            report_category(task_id, category, detected)
+    try:
+        result = await single_flight(key, lambda: analyze_content(
+            script_text, progress=on_progress, detect_only=detect_only, on_category=on_category
+        ))
+    finally:
+        if task_id is not None:
+            category_listeners[key].remove(task_id)
+            if not category_listeners[key]:
+                del category_listeners[key]
+                category_results.pop(key, None)
+    if "error" in result:
+        raise Exception(result["error"])
+    return result
+
+async def fetch_and_analyze_title(task_id: str, movie_name: str) -> dict:
+    """Fetch and analyze a movie's script, sharing the work with identical requests in flight.
+
+    Different spellings of a title that resolve to the same script page share one
+    download, and identical script texts share one model run.
+    """
+    update_progress(task_id, 0.2, "Fetching script...")
+    script_page_url = await asyncio.to_thread(resolve_script_url, movie_name)
+    if not script_page_url:
+        raise Exception("Script not found")
+    script_text = await single_flight(f"url:{script_page_url}", lambda: asyncio.to_thread(download_script, script_page_url))
+    if not script_text:
+        raise Exception("Script not found")
+
+    update_progress(task_id, 0.6, "Analyzing content...")
+    return await analyze_script_text(script_text, task_id=task_id)
+
 async def run_analysis(task_id: str, movie_name: str):
     """Run the actual analysis task"""
     try:
-        # Fetch script
-        update_progress(task_id, 0.2, "Fetching script...")
-        script_text = fetch_script(movie_name)
-        if not script_text:
-            raise Exception("Script not found")
-
-        # Analyze content
-        update_progress(task_id, 0.6, "Analyzing content...")
-        result = await analyze_content(script_text)
+        result = await fetch_and_analyze_title(task_id, movie_name)
         
         # Complete
         update_progress(task_id, 1.0, "Analysis complete", result=result)
@@ -220,6 +432,64 @@ async def run_analysis(task_id: str, movie_name: str):
     except Exception as e:
         logger.error(f"Error in analysis: {str(e)}", exc_info=True)
         update_progress(task_id, 1.0, "Error occurred", error=str(e))
+    finally:
+        if title_tasks.get(normalize_title(movie_name)) == task_id:
+            del title_tasks[normalize_title(movie_name)]
+
+async def run_batch(task_id: str, items: List[BatchItem], results: List[dict], detect_only: bool):
+    """Analyze every item of a batch, publishing each item's result in `results` as soon as it is done"""
+    finished = 0
+    semaphore = asyncio.Semaphore(max(1, BATCH_CONCURRENCY))
+
+    async def run_item(index: int, item: BatchItem):
+        nonlocal finished
+        entry = results[index]
+        async with semaphore:
+            entry["status"] = "running"
+            try:
+                script_text = item.text
+                if script_text is None:
+                    script_text = await asyncio.to_thread(fetch_script, item.title)
+                    if not script_text:
+                        raise Exception("Script not found")
+                # Concurrent items go through the same process-wide schedulers, so their chunks are batched together
+                result = await analyze_script_text(script_text, detect_only)
+                entry["status"] = "complete"
+                entry["result"] = result
+            except Exception as e:
+                logger.error(f"Batch {task_id} item {index} failed: {str(e)}")
+                entry["status"] = "error"
+                entry["error"] = str(e)
+        finished += 1
+        failed = sum(1 for result in results if result["status"] == "error")
+        update_progress(
+            task_id,
+            finished / len(results),
+            f"Analyzed {finished}/{len(results)} items" + (f" ({failed} failed)" if failed else ""),
+            result={"items": results}
+        )
+
+    await asyncio.gather(*(run_item(index, item) for index, item in enumerate(items)))
+
+@app.post("/api/analyze_batch")
+async def analyze_batch(request: BatchRequest):
+    """Start analyzing many titles or raw texts as one task; poll /api/progress/{task_id} for per-item results"""
+    if not request.items:
+        raise HTTPException(status_code=400, detail="No items to analyze")
+    if len(request.items) > MAX_BATCH_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_ITEMS} items per batch")
+    for index, item in enumerate(request.items):
+        if (item.title is None) == (item.text is None):
+            raise HTTPException(status_code=400, detail=f"Item {index} needs exactly one of title or text")
+
+    task_id = create_task_id("batch")
+    results = [
+        {"index": index, "title": item.title, "status": "queued", "result": None, "error": None}
+        for index, item in enumerate(request.items)
+    ]
+    update_progress(task_id, 0.0, f"Analyzing {len(request.items)} items...", result={"items": results})
+    asyncio.create_task(run_batch(task_id, request.items, results, request.detect_only))
+    return {"task_id": task_id, "items": len(request.items)}
 
 @app.get("/api/fetch_and_analyze")
 async def fetch_and_analyze(movie_name: str):
@@ -229,14 +499,8 @@ async def fetch_and_analyze(movie_name: str):
         task_id = create_task_id(movie_name)
         update_progress(task_id, 0.0, "Starting script search...")
         
-        # Fetch script
-        script_text = fetch_script(movie_name)
-        if not script_text:
-            raise HTTPException(status_code=404, detail="Script not found or error occurred")
-
-        # Analyze content
-        update_progress(task_id, 0.8, "Analyzing script content...")
-        result = await analyze_content(script_text)
+        # Fetch and analyze, shared with identical requests in flight
+        result = await fetch_and_analyze_title(task_id, movie_name)
         
         # Finalize
         update_progress(task_id, 1.0, "Analysis complete!")
@@ -0,0 +1,180 @@
+# title_index.py
+import os
+import re
+import json
+import heapq
+import logging
+import threading
+import unicodedata
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# JSON file of extra alias -> title entries, e.g. {"t2": "terminator 2: judgment day"}
+TITLE_ALIASES_PATH = os.environ.get("TREAT_TITLE_ALIASES", "")
+
+ARTICLES = ("the", "a", "an")
+ROMAN_NUMERALS = {"ii": "2", "iii": "3", "iv": "4", "v": "5", "vi": "6", "vii": "7", "viii": "8", "ix": "9", "x": "10"}
+
+def normalize_title(title: str) -> str:
+    """Lowercase ASCII words only: accents, punctuation and spacing differences go away."""
+    title = unicodedata.normalize("NFKD", title).encode("ascii", "ignore").decode("ascii").lower()
+    title = title.replace("&", " and ")
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", title).split())
+
+def title_forms(title: str) -> List[str]:
+    """Normalized forms a title is found under.
+
+    Covers IMSDb's trailing articles ("Matrix, The"), titles without their
+    leading article and sequel numbers written as Roman numerals.
+    """
+    forms = [normalize_title(title)]
+    trailing = re.match(r"^(.*),\s*(the|a|an)$", title.strip(), re.IGNORECASE)
+    if trailing:
+        forms.append(normalize_title(f"{trailing.group(2)} {trailing.group(1)}"))
+    for form in list(forms):
+        words = form.split()
+        if len(words) > 1 and words[0] in ARTICLES:
+            forms.append(" ".join(words[1:]))
+    for form in list(forms):
+        arabic = " ".join(ROMAN_NUMERALS.get(word, word) for word in form.split())
+        forms.append(arabic)
+    return [form for form in dict.fromkeys(forms) if form]
+
+def trigrams(text: str) -> List[str]:
+    padded = f"  {text} "
+    return [padded[i:i + 3] for i in range(len(padded) - 2)]
+
+def char_masks(query: str) -> Dict[str, int]:
+    """Bit i of a character's mask is set where the query has that character at position i."""
+    masks = {}
+    for position, char in enumerate(query):
+        masks[char] = masks.get(char, 0) | (1 << position)
+    return masks
+
+def edit_distances(masks: Dict[str, int], length: int, title: str) -> Tuple[int, int]:
+    """Levenshtein distance from a query to `title` and to the closest prefix of `title`.
+
+    Myers' bit-parallel algorithm (in Hyyro's formulation): one column of the
+    edit-distance matrix per character of `title`, held in machine words, with
+    `masks` from `char_masks(query)` and the query's `length`.
+    """
+    mask = (1 << length) - 1
+    last = 1 << (length - 1)
+    vp, vn = mask, 0
+    score = prefix = length
+    for char in title:
+        x = masks.get(char, 0) | vn
+        d0 = (((x & vp) + vp) ^ vp) | x
+        hp = vn | (~(d0 | vp) & mask)
+        hn = vp & d0
+        if hp & last:
+            score += 1
+        elif hn & last:
+            score -= 1
+        hp = ((hp << 1) | 1) & mask
+        hn = (hn << 1) & mask
+        vp = hn | (~(d0 | hp) & mask)
+        vn = hp & d0
+        if score < prefix:
+            prefix = score
+    return score, prefix
+
+class TitleIndex:
+    """Fuzzy lookup of movie titles through trigram inverted lists and edit-distance re-ranking.
+
+    Every title is indexed under its normalized forms and any extra `aliases`.
+    A query gathers candidates that share the most trigrams with it, then ranks
+    them by edit distance. Only the `candidates` best by trigram overlap are
+    compared character by character. A query that matches the start of a
+    title ("shawshank") scores `prefix_weight` times its similarity to that
+    prefix.
+    """
+
+    def __init__(
+        self,
+        titles: List[str],
+        aliases: Optional[Dict[str, str]] = None,
+        candidates: int = 16,
+        prefix_weight: float = 0.9
+    ):
+        self.titles = list(titles)
+        self.candidates = candidates
+        self.prefix_weight = prefix_weight
+        self._forms: List[Tuple[str, int]] = []
+        self._gram_counts: List[int] = []
+        self._exact: Dict[str, int] = {}
+        self._postings: Dict[str, List[int]] = {}
+        ids = {title: title_id for title_id, title in enumerate(self.titles)}
+        entries = [(form, title_id) for title_id, title in enumerate(self.titles) for form in title_forms(title)]
+        for alias, title in (aliases or {}).items():
+            if title in ids:
+                entries.extend((form, ids[title]) for form in title_forms(alias))
+            else:
+                logger.warning(f"Alias {alias!r} points at unknown title {title!r}")
+
+        for form, title_id in dict.fromkeys(entries):
+            form_id = len(self._forms)
+            grams = set(trigrams(form))
+            self._forms.append((form, title_id))
+            self._gram_counts.append(len(grams))
+            self._exact.setdefault(form, title_id)
+            for gram in grams:
+                self._postings.setdefault(gram, []).append(form_id)
+
+    def search(self, query: str, k: int = 5, min_score: float = 0.5) -> List[Tuple[str, float]]:
+        """Up to `k` (title, score) pairs, best first; the score is 1 minus the relative edit distance (to a prefix, discounted)."""
+        query = normalize_title(query)
+        if not query:
+            return []
+        results = {}
+        if query in self._exact:
+            results[self._exact[query]] = 1.0
+
+        masks = char_masks(query)
+        grams = set(trigrams(query))
+        shared = Counter(form_id for gram in grams for form_id in self._postings.get(gram, ()))
+        # Dice coefficient on trigram sets picks the few forms worth an edit-distance check
+        ranked = heapq.nlargest(
+            self.candidates, shared, key=lambda form_id: 2 * shared[form_id] / (len(grams) + self._gram_counts[form_id])
+        )
+        for form_id in ranked:
+            form, title_id = self._forms[form_id]
+            distance, prefix_distance = edit_distances(masks, len(query), form)
+            score = 1 - distance / max(len(query), len(form))
+            if len(query) >= 4 and len(form) > len(query):
+                score = max(score, self.prefix_weight * (1 - prefix_distance / len(query)))
+            if score >= min_score and score > results.get(title_id, 0):
+                results[title_id] = score
+
+        best = sorted(results.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(self.titles[title_id], round(score, 3)) for title_id, score in best]
+
+    def best(self, query: str, min_score: float = 0.6) -> Optional[str]:
+        matches = self.search(query, k=1, min_score=min_score)
+        return matches[0][0] if matches else None
+
+def load_aliases(path: str = TITLE_ALIASES_PATH) -> Dict[str, str]:
+    if not path:
+        return {}
+    try:
+        with open(path) as handle:
+            return json.load(handle)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Could not load title aliases from {path}: {str(e)}")
+        return {}
+
+_index: Optional[TitleIndex] = None
+_index_titles = None
+_index_lock = threading.Lock()
+
+def get_title_index(titles: Dict[str, str]) -> TitleIndex:
+    """Process-wide index over the keys of `titles`, rebuilt only when a different title map is passed."""
+    global _index, _index_titles
+    with _index_lock:
+        if _index is None or _index_titles is not titles:
+            _index = TitleIndex(list(titles), load_aliases())
+            _index_titles = titles
+            logger.info(f"Built title index over {len(titles)} titles")
+        return _index